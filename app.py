@@ -1,27 +1,102 @@
 import asyncio
 import logging
+import signal
 from pathlib import Path
 
 from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 from app.config import settings
 from app.handlers.admin import admin_router
-from app.handlers.booking import booking_router
+from app.handlers.booking import SESSION_FLUSH_SECONDS, booking_router, session_journal, user_sessions
 from app.handlers.contact import contact_router
 from app.handlers.start import start_router
 from app.logger import setup_logging
+from app.middlewares.ordering import PollingBackpressure, UserOrderingMiddleware
+from app.middlewares.sessions import SessionHoldMiddleware
+from app.services.outbound import SendScheduler
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, ordering: UserOrderingMiddleware) -> None:
+    """
+    Принимает апдейты через aiohttp: запрос без верного X-Telegram-Bot-Api-Secret-Token отклоняется,
+    на верный сразу отвечаем 200, а хендлеры работают в фоне. GET /health — проверка живости.
+    Пока необработанных апдейтов MAX_PENDING_UPDATES, ответ на вебхук задерживается: Telegram
+    не шлёт больше max_connections запросов одновременно и придерживает остальные у себя.
+    """
+
+    @web.middleware
+    async def backpressure(request: web.Request, handler):
+        if request.path == settings.WEBHOOK_PATH:
+            await ordering.wait_for_room()
+        return await handler(request)
+
+    app = web.Application(middlewares=[backpressure])
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=settings.WEBHOOK_SECRET,
+    ).register(app, path=settings.WEBHOOK_PATH)
+    app.router.add_get("/health", handle_health)
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, settings.WEBAPP_HOST, settings.WEBAPP_PORT).start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    try:
+        await bot.set_webhook(
+            settings.WEBHOOK_URL + settings.WEBHOOK_PATH,
+            secret_token=settings.WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logging.getLogger(__name__).info(
+            "Webhook on %s:%s%s", settings.WEBAPP_HOST, settings.WEBAPP_PORT, settings.WEBHOOK_PATH
+        )
+        await stop.wait()
+    finally:
+        # вебхук не снимаем: апдейты за время рестарта дождутся нас на стороне Telegram
+        await runner.cleanup()
+        await bot.session.close()
 
 
 async def main() -> None:
     setup_logging(Path(settings.LOG_DIR))
     logging.getLogger(__name__).info("Starting bot")
     bot = Bot(token=settings.BOT_TOKEN, parse_mode="Markdown")
+    bot.session.middleware(SendScheduler(rate=settings.SEND_RATE, chat_rate=settings.SEND_CHAT_RATE))
     dp = Dispatcher()
+    ordering = UserOrderingMiddleware(settings.MAX_IN_FLIGHT_UPDATES, settings.MAX_PENDING_UPDATES)
+    dp.update.outer_middleware(ordering)
+    dp.update.outer_middleware(SessionHoldMiddleware(user_sessions))
     dp.include_router(admin_router)
     dp.include_router(contact_router)
     dp.include_router(start_router)
     dp.include_router(booking_router)
-    await dp.start_polling(bot)
+    flusher = asyncio.create_task(session_journal.run(SESSION_FLUSH_SECONDS))
+    try:
+        if settings.use_webhook:
+            await run_webhook(bot, dp, ordering)
+        else:
+            # после запуска с вебхуком getUpdates не работает, пока вебхук не снят
+            await bot.delete_webhook()
+            bot.session.middleware(PollingBackpressure(ordering))
+            await dp.start_polling(bot, handle_as_tasks=True)
+    finally:
+        # остаток сессий сбрасывается на диск перед выходом
+        session_journal.stop()
+        await flusher
 
 
 if __name__ == "__main__":
@@ -1,4 +1,5 @@
 import os
+import secrets
 from dataclasses import dataclass
 from typing import Tuple
 
@@ -14,6 +15,13 @@ if os.getenv("HISTORY_PATH") is None:
     os.environ["HISTORY_PATH"] = "data/history_test.json" if ENV_MODE == "test" else "data/history.json"
 if os.getenv("REVIEWS_PATH") is None:
     os.environ["REVIEWS_PATH"] = "data/reviews_test.json" if ENV_MODE == "test" else "data/reviews.json"
+if os.getenv("SQLITE_PATH") is None:
+    os.environ["SQLITE_PATH"] = "data/storage_test.sqlite3" if ENV_MODE == "test" else "data/storage.sqlite3"
+if os.getenv("SESSIONS_PATH") is None:
+    os.environ["SESSIONS_PATH"] = "data/sessions_test.json" if ENV_MODE == "test" else "data/sessions.json"
+# json (по умолчанию) | journal | sqlite
+if os.getenv("STORAGE_BACKEND") is None:
+    os.environ["STORAGE_BACKEND"] = "json"
 
 
 @dataclass(frozen=True)
@@ -29,6 +37,23 @@ class Settings:
     ADMIN_IDS: Tuple[int, ...] = ()
     MODERATOR_IDS: Tuple[int, ...] = ()
     LOG_DIR: str = "logs"
+    # режим вебхука включается, если задан WEBHOOK_URL; иначе — long polling
+    WEBHOOK_URL: str = ""
+    WEBHOOK_PATH: str = "/webhook"
+    WEBHOOK_SECRET: str = ""
+    WEBAPP_HOST: str = "0.0.0.0"
+    WEBAPP_PORT: int = 8080
+    # сколько апдейтов обрабатывается одновременно (у одного пользователя — всегда по одному)
+    MAX_IN_FLIGHT_UPDATES: int = 32
+    # сколько принятых апдейтов может ждать обработки, прежде чем бот перестанет забирать новые
+    MAX_PENDING_UPDATES: int = 256
+    # лимиты Telegram на исходящие: всего на бота и в один чат (сообщений в секунду)
+    SEND_RATE: float = 30.0
+    SEND_CHAT_RATE: float = 1.0
+
+    @property
+    def use_webhook(self) -> bool:
+        return bool(self.WEBHOOK_URL)
 
 
 def load_settings() -> Settings:
@@ -41,12 +66,25 @@ def load_settings() -> Settings:
     moderators = tuple(int(x) for x in os.getenv("MODERATOR_IDS", "").split(",") if x.strip().isdigit())
     provider = os.getenv("PAYMENT_PROVIDER_TOKEN", "")
     log_dir = os.getenv("LOG_DIR", "logs")
+    webhook_url = os.getenv("WEBHOOK_URL", "").strip().rstrip("/")
+    webhook_path = "/" + os.getenv("WEBHOOK_PATH", "/webhook").strip().lstrip("/")
+    # без заданного секрета генерируем свой на запуск: вебхук всё равно перерегистрируется при старте
+    webhook_secret = os.getenv("WEBHOOK_SECRET", "").strip() or secrets.token_urlsafe(32)
     return Settings(
         BOT_TOKEN=token,
         ADMIN_IDS=admins,
         MODERATOR_IDS=moderators,
         PAYMENT_PROVIDER_TOKEN=provider,
         LOG_DIR=log_dir,
+        WEBHOOK_URL=webhook_url,
+        WEBHOOK_PATH=webhook_path,
+        WEBHOOK_SECRET=webhook_secret,
+        WEBAPP_HOST=os.getenv("WEBAPP_HOST", "0.0.0.0"),
+        WEBAPP_PORT=int(os.getenv("WEBAPP_PORT", "8080")),
+        MAX_IN_FLIGHT_UPDATES=int(os.getenv("MAX_IN_FLIGHT_UPDATES", "32")),
+        MAX_PENDING_UPDATES=int(os.getenv("MAX_PENDING_UPDATES", "256")),
+        SEND_RATE=float(os.getenv("SEND_RATE", "30")),
+        SEND_CHAT_RATE=float(os.getenv("SEND_CHAT_RATE", "1")),
     )
 
 
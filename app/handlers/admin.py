@@ -7,15 +7,22 @@ from aiogram.exceptions import TelegramBadRequest
 
 from app.config import settings
 from app.keyboards.main import main_menu_keyboard
-from app.handlers.booking import get_session
+from app.handlers.booking import get_session, session_journal
 from app.logger import get_logger
+from app.middlewares.ordering import UserLock, no_user_lock
 from app.storage import storage
 from app.services.booking import get_service_by_id
+from app.services.outbound import PRIORITY_BULK, send_priority
+from app.services.sessions import TrackedDict
 
 
 admin_router = Router()
 log = get_logger(__name__)
-admin_send_targets: Dict[int, Dict[str, int | str]] = {}
+# кому админ сейчас отправляет расклад; сохраняется вместе с сессиями записи
+admin_send_targets: TrackedDict = TrackedDict()
+session_journal.register("admin_send_targets", admin_send_targets)
+# последний запрос /admin_find_reviews каждого админа — для кнопок листания
+review_search_queries: Dict[int, str] = {}
 
 
 def is_super_admin(user_id: int) -> bool:
@@ -61,14 +68,15 @@ def format_entry(item: dict) -> str:
     urgent = "срочно" if item.get("is_urgent") else ""
     contact_text = f"@{contact}" if username else contact
     phone = item.get("phone") or "—"
+    number = f"Архив №{item.get('archive_id')}" if item.get("archive_id") is not None else f"№{item.get('position')}"
     return (
-        f"№{item.get('position')} – {item.get('name')} / ДР: {item.get('birth_date')} / услуга: {item.get('service_id')} ({urgent} {price_text})\n"
+        f"{number} – {item.get('name')} / ДР: {item.get('birth_date')} / услуга: {item.get('service_id')} ({urgent} {price_text})\n"
         f"Оплата: {pay} | Сеанс: {sess} | Контакт: {contact_text} | Телефон: {phone}"
     )
 
 
-def admin_summary(limit: int = 20) -> str:
-    items = storage.list_all()
+async def admin_summary(limit: int = 20) -> str:
+    items = await storage.alist_all()
     if not items:
         return "Очередь пуста."
     lines = ["Очередь (последние):"]
@@ -90,10 +98,14 @@ def build_admin_menu(super_admin: bool) -> str:
             "- /admin_send <позиция> –отправить расклад по экспресс-заявке\n"
             "- /admin_send_cancel –отменить отправку расклада\n"
             "- /admin_delete <позиция> –удалить/архивировать (позиции сдвигаются)\n"
+            "- /admin_archive_done –архивировать все проведённые сеансы разом\n"
             "- /admin_history –показать архив (последние)\n"
+            "- /admin_find <запрос> –поиск по имени, контакту, телефону, дате рождения и тексту запроса\n"
+            "- /admin_find_reviews <слова> –поиск по тексту отзывов (самые подходящие первыми)\n"
+            "- /admin_rebuild_stats –пересчитать статистику продаж по архиву\n"
             "Инлайн-меню: /admin (кнопки фильтров/пагинации/действий)\n"
         )
-    return "Модератор: доступен просмотр очереди через /admin_show, /admin_paid, /admin_history и инлайн-меню /admin."
+    return "Модератор: доступен просмотр очереди через /admin_show, /admin_paid, /admin_history, /admin_find, /admin_find_reviews и инлайн-меню /admin."
 
 
 def build_service_select_keyboard(filter_key: str = "all") -> InlineKeyboardMarkup:
@@ -109,16 +121,20 @@ async def send_service_select(message: Message, filter_key: str) -> None:
     await message.answer("Выберите раздел:", reply_markup=build_service_select_keyboard(filter_key), parse_mode=None)
 
 
-def parse_list_callback(data: str) -> tuple[str, str | None, int]:
+def parse_list_callback(data: str) -> tuple[str, str | None, int, str | None]:
+    # adm:list:<фильтр>:<раздел>:<страница>[:n<id>|p<id>] — курсор соседней страницы
     parts = data.split(":")
+    cursor = None
     if len(parts) == 4:
         _, _, filter_key, page_str = parts
         service_id = None
     else:
-        _, _, filter_key, service_id, page_str = parts
+        _, _, filter_key, service_id, page_str, *rest = parts
         if service_id == "all":
             service_id = None
-    return filter_key, service_id, int(page_str)
+        if rest:
+            cursor = rest[0]
+    return filter_key, service_id, int(page_str), cursor
 
 
 def parse_item_callback(data: str) -> tuple[str, str | None, int]:
@@ -141,6 +157,7 @@ def start_send_to_user(
     name: str | None,
     birth_date: str | None,
     order_created_at: str | None,
+    order_id: int | None = None,
 ) -> None:
     admin_send_targets[admin_id] = {
         "user_id": user_id,
@@ -149,12 +166,14 @@ def start_send_to_user(
         "name": name or "",
         "birth_date": birth_date or "",
         "order_created_at": order_created_at or "",
-        "order_id": None,
+        "order_id": order_id,
     }
 
 
 # --- Инлайн UI ---
 PAGE_SIZE = 5
+FIND_LIMIT = 10
+REVIEW_SNIPPET = 300
 
 
 def build_filter_buttons(current: str, service_id: str | None) -> List[List[InlineKeyboardButton]]:
@@ -176,53 +195,60 @@ def build_filter_buttons(current: str, service_id: str | None) -> List[List[Inli
     return [[btn(code, label)] for code, label in items]
 
 
-def load_items(filter_key: str, service_id: str | None) -> List[Dict]:
-    if filter_key == "paid":
-        items = storage.list_by_payment_status(["paid"])
-    elif filter_key == "done":
-        items = [item for item in storage.list_all() if item.get("session_status") == "done"]
-    elif filter_key == "notdone":
-        items = [item for item in storage.list_all() if item.get("session_status") != "done"]
-    elif filter_key == "arch":
-        items = storage.list_history(limit=100)
-    else:
-        items = storage.list_all()
-    if service_id:
-        items = [item for item in items if item.get("service_id") == service_id]
-    if filter_key != "arch":
-        items = [item for item in items if item.get("payment_status") == "paid"]
-    return items
+async def load_page(filter_key: str, service_id: str | None, cursor: str | None) -> Dict:
+    """Страница списка по курсору: n<id> — следующая после id, p<id> — предыдущая до id."""
+    after = before = None
+    if cursor and cursor[1:].isdigit():
+        if cursor[0] == "p":
+            before = int(cursor[1:])
+        else:
+            after = int(cursor[1:])
+    if filter_key == "arch":
+        return await storage.ahistory_page(service_id, after=after, before=before, limit=PAGE_SIZE)
+    session_done = {"done": True, "notdone": False}.get(filter_key)
+    return await storage.aqueue_page(
+        service_id, "paid", session_done, after=after, before=before, limit=PAGE_SIZE
+    )
 
 
-def build_list_view(filter_key: str, page: int, service_id: str | None) -> tuple[str, InlineKeyboardMarkup]:
+async def build_list_view(
+    filter_key: str, page: int, service_id: str | None, cursor: str | None = None
+) -> tuple[str, InlineKeyboardMarkup]:
     if filter_key == "stats":
-        total_orders, total_sum = storage.history_stats()
+        total_orders, total_sum = await storage.ahistory_stats()
+        breakdown = await storage.ahistory_breakdown()
         lines = [
             "Статистика продаж",
             f"Всего заказов: {total_orders}",
             f"Сумма: {total_sum}₽",
         ]
+        sections = (("service", "По услугам:"), ("month", "По месяцам:"), ("day", "По дням (последние 7):"))
+        for scope, title in sections:
+            if not breakdown[scope]:
+                continue
+            lines.append("")
+            lines.append(title)
+            for key, orders, amount in breakdown[scope]:
+                label = (service_label(key) or "без услуги") if scope == "service" else key
+                lines.append(f"- {label}: {orders} зак., {amount}₽")
         kb_rows = [[InlineKeyboardButton(text="⬅️ В меню", callback_data="adm:menu:all")]]
         return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=kb_rows)
 
     if filter_key == "reviews":
-        live_items = storage.list_all()
-        arch_items = storage.list_history(limit=1000)
-        if service_id:
-            live_items = [item for item in live_items if item.get("service_id") == service_id]
-            arch_items = [item for item in arch_items if item.get("service_id") == service_id]
-        items = []
-        for item in live_items:
-            items.append({"kind": "live", "item": item, "created_at": item.get("created_at", "")})
-        for item in arch_items:
-            items.append({"kind": "arch", "item": item, "created_at": item.get("created_at", "")})
-        items.sort(key=lambda x: x.get("created_at", ""), reverse=True)
+        start = (page - 1) * PAGE_SIZE
+        end = start + PAGE_SIZE
+        result = await storage.atimeline_page(service_id, offset=start, limit=PAGE_SIZE)
+        chunk, total = result["items"], result["total"]
+        prev_cursor = str(page - 1) if start > 0 else None
+        next_cursor = str(page + 1) if end < total else None
     else:
-        items = load_items(filter_key, service_id)
-    total = len(items)
-    start = (page - 1) * PAGE_SIZE
-    end = start + PAGE_SIZE
-    chunk = items[start:end]
+        result = await load_page(filter_key, service_id, cursor)
+        chunk, total = result["items"], result["total"]
+        if result["prev"] is None:
+            # курсор устарел и хранилище вернуло первую страницу
+            page = 1
+        prev_cursor = f"{page - 1}:p{result['prev']}" if result["prev"] is not None else None
+        next_cursor = f"{page + 1}:n{result['next']}" if result["next"] is not None else None
     titles = {
         "all": "Все",
         "paid": "Оплачено",
@@ -258,9 +284,8 @@ def build_list_view(filter_key: str, page: int, service_id: str | None) -> tuple
             order = item["item"]
             name = order.get("name") or order.get("user_fullname") or f"id:{order.get('user_id')}"
             birth_date = order.get("birth_date") or "—"
-            review = storage.get_review_for_order(order.get("order_id"))
-            mark = "✅" if review else "❌"
-            order_no = total - (start + idx)
+            mark = "✅" if item["review"] else "❌"
+            order_no = total - ((page - 1) * PAGE_SIZE + idx)
             kb_rows.append(
                 [
                     InlineKeyboardButton(
@@ -281,10 +306,10 @@ def build_list_view(filter_key: str, page: int, service_id: str | None) -> tuple
     # Фильтры
     kb_rows.extend(build_filter_buttons(filter_key, service_id))
     # Навигация
-    if start > 0:
-        kb_rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data=f"adm:list:{filter_key}:{service_code}:{page-1}")])
-    if end < total:
-        kb_rows.append([InlineKeyboardButton(text="➡️ Далее", callback_data=f"adm:list:{filter_key}:{service_code}:{page+1}")])
+    if prev_cursor:
+        kb_rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data=f"adm:list:{filter_key}:{service_code}:{prev_cursor}")])
+    if next_cursor:
+        kb_rows.append([InlineKeyboardButton(text="➡️ Далее", callback_data=f"adm:list:{filter_key}:{service_code}:{next_cursor}")])
     kb_rows.append([InlineKeyboardButton(text="⬅️ В меню", callback_data="adm:menu:all")])
     return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=kb_rows)
 
@@ -381,7 +406,7 @@ async def handle_admin_send(message: Message) -> None:
     if len(args) < 2 or not (pos := parse_position(args[1])):
         await message.answer("Укажите позицию: /admin_send <номер>")
         return
-    item = storage.get_by_position(pos)
+    item = await storage.aget_by_position(pos)
     if not item or item.get("service_id") != "express":
         await message.answer("Заявка не найдена или не относится к экспресс-раскладу.")
         return
@@ -396,8 +421,8 @@ async def handle_admin_send(message: Message) -> None:
         item.get("name"),
         item.get("birth_date"),
         item.get("created_at"),
+        item.get("order_id"),
     )
-    admin_send_targets[message.from_user.id]["order_id"] = item.get("order_id")
     await message.answer(
         "Отправьте текст/фото/документ пользователю. Для отмены: /admin_send_cancel",
     )
@@ -412,12 +437,33 @@ async def handle_admin_delete(message: Message) -> None:
     if len(args) < 2 or not (pos := parse_position(args[1])):
         await message.answer("Укажите позицию: /admin_delete <номер>")
         return
-    if storage.delete_and_archive(pos):
+    if await storage.adelete_and_archive(pos):
         await message.answer(f"Заявка №{pos} архивирована и удалена из очереди. Позиции пересчитаны.")
     else:
         await message.answer("Позиция не найдена")
 
 
+@admin_router.message(Command("admin_archive_done"))
+async def handle_admin_archive_done(message: Message) -> None:
+    if not is_super_admin(message.from_user.id):
+        await message.answer("Нет доступа.")
+        return
+    count = await storage.aarchive_done()
+    if count:
+        await message.answer(f"Архивировано проведённых сеансов: {count}. Позиции пересчитаны.")
+    else:
+        await message.answer("Проведённых сеансов в очереди нет.")
+
+
+@admin_router.message(Command("admin_rebuild_stats"))
+async def handle_admin_rebuild_stats(message: Message) -> None:
+    if not is_super_admin(message.from_user.id):
+        await message.answer("Нет доступа.")
+        return
+    total = await storage.arebuild_history_stats()
+    await message.answer(f"Статистика пересчитана по архиву: {total} заказов.")
+
+
 @admin_router.message(Command("admin_history"))
 async def handle_admin_history(message: Message) -> None:
     if not is_moderator(message.from_user.id):
@@ -426,6 +472,88 @@ async def handle_admin_history(message: Message) -> None:
     await send_service_select(message, "arch")
 
 
+@admin_router.message(Command("admin_find"))
+async def handle_admin_find(message: Message) -> None:
+    if not is_moderator(message.from_user.id):
+        await message.answer("Нет доступа.")
+        return
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2 or not args[1].strip():
+        await message.answer("Укажите запрос: /admin_find <имя, @ник, телефон, дата рождения или слова из запроса>")
+        return
+    found = await storage.afind_orders(args[1], limit=FIND_LIMIT)
+    if not found["items"]:
+        await message.answer("Ничего не найдено.")
+        return
+    lines = [f"Найдено: {found['total']}"]
+    lines.extend(format_entry(item) for item in found["items"])
+    if found["total"] > len(found["items"]):
+        lines.append(f"... показаны первые {len(found['items'])}, уточните запрос")
+    await message.answer("\n".join(lines), parse_mode=None)
+
+
+async def build_review_search_view(query: str, page: int) -> tuple[str, InlineKeyboardMarkup]:
+    offset = (page - 1) * PAGE_SIZE
+    found = await storage.asearch_reviews(query, offset=offset, limit=PAGE_SIZE)
+    lines = [f"Отзывы по запросу «{query}»: {found['total']}, страница {page}"]
+    kb_rows = []
+    for review in found["items"]:
+        text = review.get("text") or ""
+        snippet = text if len(text) <= REVIEW_SNIPPET else text[:REVIEW_SNIPPET].rstrip() + "…"
+        created = (review.get("created_at") or "").split("T")[0]
+        lines.append("")
+        lines.append(f"№{review.get('review_id')} · {service_label(review.get('service_id') or '')} · {created}")
+        lines.append(snippet)
+        if review.get("order_id"):
+            kb_rows.append(
+                [
+                    InlineKeyboardButton(
+                        text=f"Отзыв №{review.get('review_id')} целиком",
+                        callback_data=f"adm:review:all:{review.get('order_id')}",
+                    )
+                ]
+            )
+    if not found["items"]:
+        lines.append("Ничего не найдено.")
+    if page > 1:
+        kb_rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data=f"adm:rfind:{page - 1}")])
+    if offset + PAGE_SIZE < found["total"]:
+        kb_rows.append([InlineKeyboardButton(text="➡️ Далее", callback_data=f"adm:rfind:{page + 1}")])
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=kb_rows)
+
+
+@admin_router.message(Command("admin_find_reviews"))
+async def handle_admin_find_reviews(message: Message) -> None:
+    if not is_moderator(message.from_user.id):
+        await message.answer("Нет доступа.")
+        return
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2 or not args[1].strip():
+        await message.answer("Укажите слова для поиска: /admin_find_reviews <слова>")
+        return
+    query = args[1].strip()
+    review_search_queries[message.from_user.id] = query
+    text, kb = await build_review_search_view(query, 1)
+    await message.answer(text, reply_markup=kb, parse_mode=None)
+
+
+@admin_router.callback_query(F.data.startswith("adm:rfind:"))
+async def cb_admin_find_reviews(callback: CallbackQuery) -> None:
+    if not is_moderator(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    query = review_search_queries.get(callback.from_user.id)
+    if not query:
+        await callback.answer("Запрос устарел, повторите /admin_find_reviews", show_alert=True)
+        return
+    text, kb = await build_review_search_view(query, int(callback.data.split(":")[2]))
+    try:
+        await callback.message.edit_text(text, reply_markup=kb, parse_mode=None)
+    except TelegramBadRequest:
+        await callback.message.answer(text, reply_markup=kb, parse_mode=None)
+    await callback.answer()
+
+
 @admin_router.message(Command("admin_send_cancel"))
 async def handle_admin_send_cancel(message: Message) -> None:
     if not is_super_admin(message.from_user.id):
@@ -460,7 +588,7 @@ async def cb_clear_history_confirm(callback: CallbackQuery) -> None:
     if not is_super_admin(callback.from_user.id):
         await callback.answer("Нет доступа", show_alert=True)
         return
-    storage.clear_history()
+    await storage.aclear_history()
     await callback.message.edit_text("Архив очищен.")
     await callback.answer("Очищено")
 
@@ -483,7 +611,7 @@ async def handle_admin_pay(message: Message) -> None:
     if len(args) < 2 or not (pos := parse_position(args[1])):
         await message.answer("Укажите позицию: /admin_pay <номер>")
         return
-    if storage.update_payment_status(pos, "paid"):
+    if await storage.aupdate_payment_status(pos, "paid"):
         log.info("Payment marked paid by %s for position %s", message.from_user.id, pos)
         await message.answer(f"Оплата для №{pos} установлена: paid")
     else:
@@ -499,7 +627,7 @@ async def handle_admin_unpay(message: Message) -> None:
     if len(args) < 2 or not (pos := parse_position(args[1])):
         await message.answer("Укажите позицию: /admin_unpay <номер>")
         return
-    if storage.update_payment_status(pos, "pending"):
+    if await storage.aupdate_payment_status(pos, "pending"):
         log.info("Payment marked pending by %s for position %s", message.from_user.id, pos)
         await message.answer(f"Оплата для №{pos} установлена: pending")
     else:
@@ -515,7 +643,7 @@ async def handle_admin_done(message: Message) -> None:
     if len(args) < 2 or not (pos := parse_position(args[1])):
         await message.answer("Укажите позицию: /admin_done <номер>")
         return
-    if storage.update_session_status(pos, "done"):
+    if await storage.aupdate_session_status(pos, "done"):
         log.info("Session marked done by %s for position %s", message.from_user.id, pos)
         await message.answer(f"Сеанс для №{pos} установлен: done")
     else:
@@ -531,7 +659,7 @@ async def handle_admin_undone(message: Message) -> None:
     if len(args) < 2 or not (pos := parse_position(args[1])):
         await message.answer("Укажите позицию: /admin_undone <номер>")
         return
-    if storage.update_session_status(pos, "pending"):
+    if await storage.aupdate_session_status(pos, "pending"):
         log.info("Session marked pending by %s for position %s", message.from_user.id, pos)
         await message.answer(f"Сеанс для №{pos} установлен: pending")
     else:
@@ -545,7 +673,7 @@ async def cb_admin_service(callback: CallbackQuery) -> None:
         await callback.answer("Нет доступа", show_alert=True)
         return
     _, _, service_id, filter_key = callback.data.split(":", 3)
-    text, kb = build_list_view(filter_key, 1, service_id)
+    text, kb = await build_list_view(filter_key, 1, service_id)
     if filter_key == "arch":
         kb.inline_keyboard.append([InlineKeyboardButton(text="🗑 Очистить архив", callback_data="adm:clear_history")])
     try:
@@ -560,7 +688,7 @@ async def cb_admin_stats(callback: CallbackQuery) -> None:
     if not is_moderator(callback.from_user.id):
         await callback.answer("Нет доступа", show_alert=True)
         return
-    text, kb = build_list_view("stats", 1, None)
+    text, kb = await build_list_view("stats", 1, None)
     try:
         await callback.message.edit_text(text, reply_markup=kb, parse_mode=None)
     except TelegramBadRequest:
@@ -588,7 +716,7 @@ async def cb_admin_send(callback: CallbackQuery) -> None:
     else:
         _, _, _, pos_str = parts
     pos = int(pos_str)
-    item = storage.get_by_position(pos)
+    item = await storage.aget_by_position(pos)
     if not item or item.get("service_id") != "express":
         await callback.answer("Заявка не найдена", show_alert=True)
         return
@@ -603,8 +731,8 @@ async def cb_admin_send(callback: CallbackQuery) -> None:
         item.get("name"),
         item.get("birth_date"),
         item.get("created_at"),
+        item.get("order_id"),
     )
-    admin_send_targets[callback.from_user.id]["order_id"] = item.get("order_id")
     await callback.message.answer(
         "Отправьте текст/фото/документ пользователю. Для отмены: /admin_send_cancel",
         parse_mode=None,
@@ -626,13 +754,13 @@ async def cb_admin_review(callback: CallbackQuery) -> None:
         if service_id == "all":
             service_id = None
     order_id = int(order_str)
-    item = storage.get_by_order_id(order_id) or storage.get_history_by_order_id(order_id)
+    item = await storage.aget_by_order_id(order_id) or await storage.aget_history_by_order_id(order_id)
     if not item:
         await callback.answer("Заказ не найден", show_alert=True)
         return
     name = item.get("name") or item.get("user_fullname") or f"id:{item.get('user_id')}"
     birth_date = item.get("birth_date") or "—"
-    review = storage.get_review_for_order(item.get("order_id"))
+    review = await storage.aget_review_for_order(item.get("order_id"))
     if review:
         created = review.get("created_at") or "—"
         text = review.get("text") or "—"
@@ -658,11 +786,7 @@ async def cb_admin_result(callback: CallbackQuery) -> None:
         return
     _, _, order_str = callback.data.split(":", 2)
     order_id = int(order_str)
-    item = storage.get_by_order_id(order_id) or storage.get_history_by_order_id(order_id)
-    if not item:
-        await callback.answer("Заказ не найден", show_alert=True)
-        return
-    payload = item.get("result_payload") if isinstance(item, dict) else None
+    payload = await storage.aget_result_payload(order_id)
     if not isinstance(payload, dict):
         await callback.answer("Расклад не найден", show_alert=True)
         return
@@ -691,8 +815,8 @@ async def cb_admin_list(callback: CallbackQuery) -> None:
     if not is_moderator(callback.from_user.id):
         await callback.answer("Нет доступа", show_alert=True)
         return
-    filter_key, service_id, page = parse_list_callback(callback.data)
-    text, kb = build_list_view(filter_key, page, service_id)
+    filter_key, service_id, page, cursor = parse_list_callback(callback.data)
+    text, kb = await build_list_view(filter_key, page, service_id, cursor)
     if filter_key == "arch":
         kb.inline_keyboard.append([InlineKeyboardButton(text="🗑 Очистить архив", callback_data="adm:clear_history")])
     try:
@@ -708,7 +832,7 @@ async def cb_admin_item(callback: CallbackQuery) -> None:
         await callback.answer("Нет доступа", show_alert=True)
         return
     filter_key, service_id, pos = parse_item_callback(callback.data)
-    item = storage.get_by_position(pos)
+    item = await storage.aget_by_position(pos)
     if not item:
         await callback.answer("Не найдено", show_alert=True)
         return
@@ -757,7 +881,7 @@ async def cb_admin_pay(callback: CallbackQuery) -> None:
         return
     _, _, pos_str, status = callback.data.split(":", 3)
     pos = int(pos_str)
-    if storage.update_payment_status(pos, status):
+    if await storage.aupdate_payment_status(pos, status):
         await callback.answer("Обновлено")
     else:
         await callback.answer("Не найдено", show_alert=True)
@@ -770,8 +894,8 @@ async def cb_admin_session(callback: CallbackQuery) -> None:
         return
     _, _, pos_str, status = callback.data.split(":", 3)
     pos = int(pos_str)
-    if storage.update_session_status(pos, status):
-        item = storage.get_by_position(pos)
+    if await storage.aupdate_session_status(pos, status):
+        item = await storage.aget_by_position(pos)
         if not item:
             await callback.answer("Не найдено", show_alert=True)
             return
@@ -824,8 +948,8 @@ async def cb_admin_delete(callback: CallbackQuery) -> None:
         if service_id == "all":
             service_id = None
     pos = int(pos_str)
-    if storage.delete_and_archive(pos):
-        text, kb = build_list_view("all", 1, service_id)
+    if await storage.adelete_and_archive(pos):
+        text, kb = await build_list_view("all", 1, service_id)
         await callback.message.edit_text(text, reply_markup=kb, parse_mode=None)
         await callback.answer("Удалено и обновлено")
     else:
@@ -839,7 +963,7 @@ async def cb_admin_architem(callback: CallbackQuery) -> None:
 
 
 @admin_router.message(F.text | F.photo | F.document, lambda message: message.from_user.id in admin_send_targets)
-async def handle_admin_send_result(message: Message) -> None:
+async def handle_admin_send_result(message: Message, user_lock: UserLock = no_user_lock) -> None:
     if not is_super_admin(message.from_user.id):
         return
     target = admin_send_targets.get(message.from_user.id)
@@ -855,35 +979,40 @@ async def handle_admin_send_result(message: Message) -> None:
     review_order_created_at = str(target.get("order_created_at") or "")
     review_order_id = target.get("order_id")
     payload = None
-    if message.photo:
-        file_id = message.photo[-1].file_id
-        await message.bot.send_photo(user_id, photo=file_id, caption=message.caption or None)
-        payload = {"type": "photo", "file_id": file_id, "caption": message.caption or None}
-    elif message.document:
-        await message.bot.send_document(user_id, document=message.document.file_id, caption=message.caption or None)
-        payload = {"type": "document", "file_id": message.document.file_id, "caption": message.caption or None}
-    elif message.text:
-        await message.bot.send_message(user_id, message.text)
-        payload = {"type": "text", "text": message.text}
-    else:
+    # расклад и просьба об отзыве уходят в фоновой полосе: ответы тем, кто сейчас пишет боту, — раньше
+    with send_priority(PRIORITY_BULK):
+        if message.photo:
+            file_id = message.photo[-1].file_id
+            await message.bot.send_photo(user_id, photo=file_id, caption=message.caption or None)
+            payload = {"type": "photo", "file_id": file_id, "caption": message.caption or None}
+        elif message.document:
+            await message.bot.send_document(user_id, document=message.document.file_id, caption=message.caption or None)
+            payload = {"type": "document", "file_id": message.document.file_id, "caption": message.caption or None}
+        elif message.text:
+            await message.bot.send_message(user_id, message.text)
+            payload = {"type": "text", "text": message.text}
+    if payload is None:
         await message.answer("Отправьте текст, фото или документ.")
         return
-    session = get_session(user_id)
-    session.step = "review"
-    session.service_id = service_id
-    session.review_name = review_name or None
-    session.review_birth_date = review_birth_date or None
-    session.review_order_created_at = review_order_created_at or None
-    session.review_order_id = review_order_id if isinstance(review_order_id, int) else None
+    # сессия получателя: ждём его текущий апдейт, чтобы не перемешать правки
+    async with user_lock(user_id):
+        session = get_session(user_id)
+        session.step = "review"
+        session.service_id = service_id
+        session.review_name = review_name or None
+        session.review_birth_date = review_birth_date or None
+        session.review_order_created_at = review_order_created_at or None
+        session.review_order_id = review_order_id if isinstance(review_order_id, int) else None
     if isinstance(review_order_id, int) and payload:
-        storage.set_result_sent(review_order_id, payload)
-    await message.bot.send_message(
-        user_id,
-        "Хочешь помочь нам исправить какие-то недостатки или пожелать чего-то нового? "
-        "Напиши отзыв (минимум 100 символов).",
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[[InlineKeyboardButton(text="Нет, спасибо", callback_data="review_skip")]]
-        ),
-    )
+        await storage.aset_result_sent(review_order_id, payload)
+    with send_priority(PRIORITY_BULK):
+        await message.bot.send_message(
+            user_id,
+            "Хочешь помочь нам исправить какие-то недостатки или пожелать чего-то нового? "
+            "Напиши отзыв (минимум 100 символов).",
+            reply_markup=InlineKeyboardMarkup(
+                inline_keyboard=[[InlineKeyboardButton(text="Нет, спасибо", callback_data="review_skip")]]
+            ),
+        )
     admin_send_targets.pop(message.from_user.id, None)
     await message.answer(f"Расклад отправлен пользователю (заявка №{position}).")
@@ -1,4 +1,5 @@
-from typing import Dict
+import os
+from pathlib import Path
 
 from aiogram import F, Router
 from aiogram.types import CallbackQuery, Message
@@ -11,6 +12,7 @@ from app.keyboards.services import services_keyboard
 from app.logger import get_logger
 from app.models import BookingSession
 from app.services.booking import get_service_by_id, get_service_price, now_ekb, validate_birth_date
+from app.services.sessions import SessionJournal, SessionStore
 from app.storage import storage
 from app.texts import (
     ask_birth_date_text,
@@ -28,17 +30,25 @@ from app.texts import (
 
 booking_router = Router()
 
-user_sessions: Dict[int, BookingSession] = {}
+# отзыв могут оставить через несколько дней после расклада, поэтому TTL по умолчанию — неделя
+SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", "168"))
+SESSION_MAX_USERS = int(os.getenv("SESSION_MAX_USERS", "10000"))
+SESSIONS_PATH = Path(os.getenv("SESSIONS_PATH", "data/sessions.json"))
+SESSION_FLUSH_SECONDS = float(os.getenv("SESSION_FLUSH_SECONDS", "1"))
+
+# сессии переживают рестарт: изменения раз в SESSION_FLUSH_SECONDS дописываются в журнал
+session_journal = SessionJournal(SESSIONS_PATH)
+user_sessions = SessionStore(ttl=SESSION_TTL_HOURS * 3600, max_size=SESSION_MAX_USERS)
+session_journal.register("sessions", user_sessions)
 log = get_logger(__name__)
 
 
 def reset_session(user_id: int) -> BookingSession:
-    user_sessions[user_id] = BookingSession()
-    return user_sessions[user_id]
+    return user_sessions.reset(user_id)
 
 
 def get_session(user_id: int) -> BookingSession:
-    return user_sessions.setdefault(user_id, BookingSession())
+    return user_sessions.get(user_id)
 
 
 @booking_router.callback_query(F.data == "start_booking")
@@ -104,7 +114,7 @@ async def handle_steps(message: Message) -> None:
             await message.answer("Отзыв должен быть минимум 100 символов. Попробуйте ещё раз.")
             return
         full_name = " ".join(filter(None, [message.from_user.first_name, message.from_user.last_name]))
-        storage.add_review(
+        await storage.aadd_review(
             user_id=message.from_user.id,
             service_id=session.service_id or "",
             text=text,
@@ -176,7 +186,7 @@ async def handle_review_skip(callback: CallbackQuery) -> None:
         await callback.answer()
         return
     if isinstance(session.review_order_id, int):
-        storage.set_review_skipped(session.review_order_id)
+        await storage.aset_review_skipped(session.review_order_id)
     reset_session(callback.from_user.id)
     await callback.message.answer("Спасибо! Возвращаю в меню.", reply_markup=main_menu_keyboard())
     await callback.answer()
@@ -193,7 +203,7 @@ async def handle_successful_payment(message: Message) -> None:
         reset_session(message.from_user.id)
         return
     full_name = " ".join(filter(None, [message.from_user.first_name, message.from_user.last_name]))
-    position = storage.add_request(
+    position = await storage.aadd_request(
         user_id=message.from_user.id,
         service_id=session.service_id,
         birth_date=session.birth_date,
@@ -4,7 +4,7 @@ from aiogram.types import CallbackQuery, Message
 
 from app.handlers.booking import reset_session
 from app.keyboards.main import main_menu_keyboard
-from app.storage import storage
+from app.storage import format_user_order, storage
 from app.texts import build_start_text
 
 
@@ -20,9 +20,16 @@ async def handle_start(message: Message) -> None:
 @start_router.callback_query(F.data == "my_bookings")
 async def handle_my_bookings(callback: CallbackQuery) -> None:
     await callback.answer()
-    bookings = storage.list_user_requests(callback.from_user.id)
-    if not bookings:
+    orders = await storage.alist_user_orders(callback.from_user.id)
+    if not orders:
         text = "У вас пока нет заявок. Оформите новую через «Записаться»."
     else:
-        text = "Ваши заявки:\n" + "\n".join(f"• {item}" for item in bookings)
+        current = [format_user_order(item) for item in orders if item.get("archive_id") is None]
+        past = [format_user_order(item) for item in orders if item.get("archive_id") is not None]
+        lines = ["Ваши заявки:"]
+        if current:
+            lines += ["Текущие:"] + [f"• {item}" for item in current]
+        if past:
+            lines += ["Прошлые:"] + [f"• {item}" for item in past]
+        text = "\n".join(lines)
     await callback.message.answer(text, parse_mode=None)
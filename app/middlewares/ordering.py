@@ -0,0 +1,140 @@
+import asyncio
+from contextlib import asynccontextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import GetUpdates, Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+# захват очереди пользователя из хендлера: async with user_lock(user_id): ...
+UserLock = Callable[[int], AsyncContextManager[None]]
+
+
+def no_user_lock(user_id: int) -> AsyncContextManager[None]:
+    """Заглушка для хендлеров, запущенных без UserOrderingMiddleware."""
+    return nullcontext()
+
+
+class UserOrderingMiddleware(BaseMiddleware):
+    """
+    Апдейты обрабатываются задачами параллельно, но апдейты одного пользователя идут строго
+    по очереди: шаги сессии записи и read-modify-write в хранилище не перемешиваются. Разные
+    пользователи не ждут друг друга. Одновременно работает не больше max_in_flight хендлеров.
+    Слот берётся уже после очереди пользователя, поэтому ждущие апдейты одного пользователя
+    (например, за медленной отправкой расклада админом) не занимают слоты остальных.
+
+    Семафор ограничивает только исполнение: задачи на апдейты создаёт сам aiogram. Чтобы
+    очередь ждущих не росла без предела, middleware считает принятые, но не обработанные
+    апдейты; когда их max_pending, приём новых ждёт (wait_for_room) — polling не запрашивает
+    getUpdates (PollingBackpressure), вебхук не отвечает Telegram.
+
+    Хендлер, который меняет состояние другого пользователя (админ отправляет расклад и переводит
+    сессию получателя в отзыв), берёт его очередь через data["user_lock"]: правка не вклинится
+    в апдейт, который этот пользователь сейчас обрабатывает.
+    """
+
+    def __init__(self, max_in_flight: int, max_pending: int) -> None:
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # сколько апдейтов пользователя держат или ждут его замок: на нуле замок удаляется
+        self._users: Dict[int, int] = {}
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self.max_pending = max_pending
+        self._pending = 0
+        self._room = asyncio.Event()
+        self._room.set()
+        # пользователь, чей апдейт обрабатывается в текущей задаче: свою очередь повторно не ждём
+        self._current: ContextVar[Optional[int]] = ContextVar("ordering_user", default=None)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def wait_for_room(self) -> None:
+        # задачи только что полученной пачки должны успеть дойти до middleware и попасть в счётчик
+        await asyncio.sleep(0)
+        await self._room.wait()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        data["user_lock"] = self.user_lock
+        self._pending += 1
+        if self._pending >= self.max_pending:
+            self._room.clear()
+        try:
+            return await self._handle(handler, event, data)
+        finally:
+            self._pending -= 1
+            if self._pending < self.max_pending:
+                self._room.set()
+
+    async def _handle(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            async with self._slots:
+                return await handler(event, data)
+        async with self._queue(user.id):
+            token = self._current.set(user.id)
+            try:
+                async with self._slots:
+                    return await handler(event, data)
+            finally:
+                self._current.reset(token)
+
+    @asynccontextmanager
+    async def _queue(self, user_id: int) -> AsyncIterator[None]:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        self._users[user_id] = self._users.get(user_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[user_id] -= 1
+            if not self._users[user_id]:
+                del self._users[user_id]
+                del self._locks[user_id]
+
+    @asynccontextmanager
+    async def user_lock(self, user_id: int) -> AsyncIterator[None]:
+        """
+        Очередь другого пользователя для хендлера: блок ждёт, пока его текущий апдейт обработается.
+        Обычные хендлеры чужих очередей не берут, поэтому ожидание не зацикливается.
+        """
+        if self._current.get() == user_id:
+            yield
+            return
+        async with self._queue(user_id):
+            yield
+
+
+class PollingBackpressure(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: следующий getUpdates уходит, только когда в UserOrderingMiddleware
+    есть место. Сверх max_pending может набраться не больше одной пачки getUpdates (до 100 апдейтов).
+    """
+
+    def __init__(self, ordering: UserOrderingMiddleware) -> None:
+        self._ordering = ordering
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if isinstance(method, GetUpdates):
+            await self._ordering.wait_for_room()
+        return await make_request(bot, method)
@@ -0,0 +1,25 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from app.services.sessions import SessionStore
+
+
+class SessionHoldMiddleware(BaseMiddleware):
+    """
+    Держит сессии, выданные хендлеру, изменёнными до конца обработки апдейта: правки после
+    await (например, после edit_text) уйдут на диск следующим сбросом, а не потеряются.
+    """
+
+    def __init__(self, store: SessionStore) -> None:
+        self._store = store
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        with self._store.hold():
+            return await handler(event, data)
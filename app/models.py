@@ -2,7 +2,7 @@ from dataclasses import dataclass
 from typing import Optional
 
 
-@dataclass
+@dataclass(slots=True)
 class BookingSession:
     service_id: Optional[str] = None
     is_urgent: bool = False
@@ -0,0 +1,216 @@
+import bisect
+import math
+import re
+from collections import Counter
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+# поля заказа, по которым ищет /admin_find
+SEARCH_FIELDS = ("name", "user_username", "user_fullname", "phone", "birth_date", "problem")
+
+_WORD = re.compile(r"[^\W_]+")
+_PHONE = re.compile(r"[\d\s()+\-]+")
+
+
+def normalize(text: str) -> str:
+    # casefold вместо lower, ё и е не различаем
+    return text.casefold().replace("ё", "е")
+
+
+def tokenize(text: str) -> List[str]:
+    return _WORD.findall(normalize(text))
+
+
+def _phone_tokens(value: str) -> List[str]:
+    digits = re.sub(r"\D", "", value)
+    if not digits:
+        return []
+    # +7 / 8 в начале номера не обязательны при поиске
+    if len(digits) == 11 and digits[0] in "78":
+        return [digits, digits[1:]]
+    return [digits]
+
+
+def item_tokens(item: Dict) -> Set[str]:
+    tokens: Set[str] = set()
+    for field in SEARCH_FIELDS:
+        value = item.get(field)
+        if value:
+            tokens.update(tokenize(str(value)))
+    tokens.update(_phone_tokens(item.get("phone") or ""))
+    return tokens
+
+
+def query_tokens(query: str) -> List[str]:
+    query = query.strip()
+    # запрос, похожий на номер телефона, ищем по цифрам целиком и без +7 / 8 в начале
+    digits = re.sub(r"\D", "", query)
+    if _PHONE.fullmatch(query) and len(digits) >= 5:
+        return [digits[1:] if digits[0] in "78" else digits]
+    return tokenize(query)
+
+
+class SearchIndex:
+    """
+    Инвертированный индекс: токен -> ключи документов. Словарь токенов хранится отсортированным,
+    поэтому поиск по префиксу — бинарный поиск и проход по соседним токенам. Обновляется точечно.
+    """
+
+    def __init__(self) -> None:
+        self.postings: Dict[str, Set[Hashable]] = {}
+        self.vocab: List[str] = []
+        self.docs: Dict[Hashable, Set[str]] = {}
+
+    def add(self, key: Hashable, item: Dict) -> None:
+        self.remove(key)
+        tokens = item_tokens(item)
+        self.docs[key] = tokens
+        for token in tokens:
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = set()
+                bisect.insort(self.vocab, token)
+            posting.add(key)
+
+    def remove(self, key: Hashable) -> None:
+        for token in self.docs.pop(key, ()):
+            posting = self.postings[token]
+            posting.discard(key)
+            if not posting:
+                del self.postings[token]
+                del self.vocab[bisect.bisect_left(self.vocab, token)]
+
+    def _prefixed(self, prefix: str) -> Set[Hashable]:
+        matched: Set[Hashable] = set()
+        idx = bisect.bisect_left(self.vocab, prefix)
+        while idx < len(self.vocab) and self.vocab[idx].startswith(prefix):
+            matched |= self.postings[self.vocab[idx]]
+            idx += 1
+        return matched
+
+    def search(self, query: str) -> Set[Hashable]:
+        """Документы, где каждое слово запроса — начало какого-то токена."""
+        result: Optional[Set[Hashable]] = None
+        for token in query_tokens(query):
+            matched = self._prefixed(token)
+            result = matched if result is None else result & matched
+            if not result:
+                break
+        return result or set()
+
+
+def matches(query: str, items: Iterable[Dict]) -> List[Dict]:
+    """Тот же поиск линейным проходом — для хранилищ без индекса."""
+    tokens = query_tokens(query)
+    found = []
+    for item in items:
+        own = item_tokens(item)
+        if tokens and all(any(token.startswith(prefix) for token in own) for prefix in tokens):
+            found.append(item)
+    return found
+
+
+# --- Полнотекстовый поиск по отзывам ---
+# Стеммер Портера для русского языка (упрощённый Snowball): окончания отрезаются только в RV —
+# части слова после первой гласной.
+_RV = re.compile(r"^(.*?[аеиоуыэюя])(.*)$")
+_PERFECTIVE_GERUND = re.compile(r"((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$")
+_REFLEXIVE = re.compile(r"(с[яь])$")
+_ADJECTIVE = re.compile(r"(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$")
+_PARTICIPLE = re.compile(r"((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$")
+_VERB = re.compile(
+    r"((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)"
+    r"|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$"
+)
+_NOUN = re.compile(
+    r"(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$"
+)
+_DERIVATIONAL = re.compile(r".*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$")
+
+
+def stem(word: str) -> str:
+    """Основа русского слова; слова не на кириллице возвращаются как есть."""
+    match = _RV.match(word)
+    if not match or not re.search("[а-я]", word):
+        return word
+    head, rv = match.groups()
+    cut = _PERFECTIVE_GERUND.sub("", rv, 1)
+    if cut == rv:
+        rv = _REFLEXIVE.sub("", rv, 1)
+        cut = _ADJECTIVE.sub("", rv, 1)
+        if cut != rv:
+            rv = _PARTICIPLE.sub("", cut, 1)
+        else:
+            cut = _VERB.sub("", rv, 1)
+            rv = _NOUN.sub("", rv, 1) if cut == rv else cut
+    else:
+        rv = cut
+    rv = re.sub("и$", "", rv, 1)
+    if _DERIVATIONAL.match(rv):
+        rv = re.sub("ость?$", "", rv, 1)
+    cut = re.sub("ь$", "", rv, 1)
+    if cut == rv:
+        rv = re.sub("нн$", "н", re.sub("(ейше|ейш)$", "", rv, 1), 1)
+    else:
+        rv = cut
+    return head + rv
+
+
+def text_terms(text: str) -> List[str]:
+    return [stem(token) for token in tokenize(text)]
+
+
+class TextIndex:
+    """
+    Индекс текстов с ранжированием BM25: термин (основа слова) -> {документ: частота}.
+    Формула — как у bm25() в SQLite FTS5, чтобы бэкенды ранжировали одинаково.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self) -> None:
+        self.postings: Dict[str, Dict[Hashable, int]] = {}
+        self.lengths: Dict[Hashable, int] = {}
+        self.terms: Dict[Hashable, List[str]] = {}
+        self.total_length = 0
+
+    def add(self, key: Hashable, text: str) -> None:
+        self.remove(key)
+        counts = Counter(text_terms(text))
+        length = sum(counts.values())
+        self.lengths[key] = length
+        self.total_length += length
+        self.terms[key] = list(counts)
+        for term, count in counts.items():
+            self.postings.setdefault(term, {})[key] = count
+
+    def remove(self, key: Hashable) -> None:
+        for term in self.terms.pop(key, ()):
+            posting = self.postings[term]
+            del posting[key]
+            if not posting:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(key, 0)
+
+    def search(self, query: str) -> List[Tuple[float, Hashable]]:
+        """Документы, где есть хотя бы один термин запроса, лучшие первыми."""
+        count = len(self.lengths)
+        if not count:
+            return []
+        average = self.total_length / count or 1
+        scores: Dict[Hashable, float] = {}
+        for term in set(text_terms(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log((count - len(posting) + 0.5) / (len(posting) + 0.5))
+            idf = idf if idf > 0 else 1e-6
+            for key, freq in posting.items():
+                norm = self.K1 * (1 - self.B + self.B * self.lengths[key] / average)
+                scores[key] = scores.get(key, 0.0) + idf * freq * (self.K1 + 1) / (freq + norm)
+        return sorted(((score, key) for key, score in scores.items()), key=lambda x: (-x[0], _desc(x[1])))
+
+
+def _desc(key: Hashable):
+    # при равном счёте — более новые (больший id) первыми
+    return -key if isinstance(key, (int, float)) else key
@@ -5,6 +5,9 @@ from zoneinfo import ZoneInfo
 from app.config import settings
 
 
+EKB_TZ = ZoneInfo("Asia/Yekaterinburg")
+
+
 def get_service_by_id(service_id: str) -> Optional[Dict]:
     return next((item for item in settings.SERVICES if item["id"] == service_id), None)
 
@@ -16,7 +19,7 @@ def get_service_price(service_id: str, default_price: int = 2500) -> int:
 
 
 def now_ekb() -> datetime:
-    return datetime.now(ZoneInfo("Asia/Yekaterinburg"))
+    return datetime.now(EKB_TZ)
 
 
 def validate_birth_date(text: str) -> tuple[bool, str]:
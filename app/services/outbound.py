@@ -0,0 +1,154 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from app.logger import get_logger
+
+
+log = get_logger(__name__)
+
+# ответы пользователям уходят раньше массовых рассылок
+PRIORITY_REPLY = 0
+PRIORITY_BULK = 1
+
+_priority: ContextVar[int] = ContextVar("send_priority", default=PRIORITY_REPLY)
+
+
+@contextmanager
+def send_priority(level: int) -> Iterator[None]:
+    """Все отправки внутри блока идут с приоритетом level (например, PRIORITY_BULK для рассылки)."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity про запас. Токены можно брать в долг — это очередь."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self, now: float) -> float:
+        """Берёт токен (при необходимости в долг) и возвращает, сколько ждать до отправки."""
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """
+    Планировщик исходящих сообщений — middleware сессии бота, через него проходят и bot.send_*,
+    и message.answer. Отправка ждёт токен своего чата (1 сообщение/с в личке, 20 в минуту в группе,
+    с небольшим запасом на серию), затем общий токен (~30 сообщений/с на бота). Общие токены
+    раздаются по приоритету: PRIORITY_REPLY раньше PRIORITY_BULK. На TelegramRetryAfter отправки
+    бота замирают на указанное время, и запрос повторяется. Вызывающий просто ждёт результат
+    своего await bot.send_...(...), как и без планировщика.
+    """
+
+    # методы, которые создают сообщения; правки, удаления и ответы на колбэки не ограничиваем
+    THROTTLED = frozenset({"copyMessage", "forwardMessage"})
+    CHAT_BURST = 3
+    GROUP_RATE = 20 / 60
+    MAX_CHAT_BUCKETS = 4096
+
+    def __init__(self, rate: float = 30.0, chat_rate: float = 1.0, max_retries: int = 3) -> None:
+        self.chat_rate = chat_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(rate, rate)
+        self._chats: Dict[Union[int, str], TokenBucket] = {}
+        # ждущие общего токена: (приоритет, порядковый номер, future)
+        self._waiting: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+
+    @classmethod
+    def _throttled(cls, method: TelegramMethod) -> bool:
+        name = method.__api_method__
+        return (name.startswith("send") and name != "sendChatAction") or name in cls.THROTTLED
+
+    def _chat_bucket(self, chat_id: Union[int, str], now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                # полные корзины ничего не помнят — их можно выбросить
+                self._chats = {k: v for k, v in self._chats.items() if not v.idle(now)}
+            # отрицательный chat_id (или @username) — группа или канал
+            group = not isinstance(chat_id, int) or chat_id < 0
+            rate = self.GROUP_RATE if group else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.CHAT_BURST)
+        return bucket
+
+    async def _acquire_global(self, priority: int) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._seq), future))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        await future
+
+    async def _run_pump(self) -> None:
+        while self._waiting:
+            now = time.monotonic()
+            delay = max(self._paused_until - now, self._global.delay(now))
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiting)
+            if future.done():  # отправку отменили, пока она ждала
+                continue
+            self._global.reserve(now)
+            future.set_result(None)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not self._throttled(method):
+            return await make_request(bot, method)
+        priority = _priority.get()
+        attempt = 0
+        while True:
+            now = time.monotonic()
+            delay = self._chat_bucket(chat_id, now).reserve(now)
+            if delay:
+                await asyncio.sleep(delay)
+            await self._acquire_global(priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                log.warning("Flood control on %s to %s: retry in %ss", method.__api_method__, chat_id, e.retry_after)
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
@@ -0,0 +1,321 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, fields
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from app.logger import get_logger
+from app.models import BookingSession
+from app.storage import FileWrites, apply_writes, atomic_write_text, prepare_writes, recover_writes
+
+
+log = get_logger(__name__)
+
+_SESSION_FIELDS = {f.name for f in fields(BookingSession)}
+
+
+class SessionStore:
+    """
+    Сессии записи в памяти: не больше max_size пользователей (вытесняются давно неактивные)
+    и не дольше ttl секунд без обращений. Порядок в OrderedDict — порядок последнего обращения,
+    поэтому и LRU, и просроченные снимаются с одного конца. Чистка идёт попутно, не чаще sweep_interval.
+    """
+
+    def __init__(self, ttl: float, max_size: int, sweep_interval: float = 60.0) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sweep_interval = sweep_interval
+        self._sessions: "OrderedDict[int, BookingSession]" = OrderedDict()
+        self._touched: Dict[int, float] = {}
+        self._last_sweep = time.monotonic()
+        # пользователи, чьи сессии могли измениться с прошлого сброса на диск
+        self._dirty: Set[int] = set()
+        # сессии, выданные внутри текущего hold() (апдейта)
+        self._held: ContextVar[Optional[Set[int]]] = ContextVar("held_sessions", default=None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._sessions
+
+    def _touch(self, user_id: int, now: float) -> None:
+        self._sessions.move_to_end(user_id)
+        self._touched[user_id] = now
+        self._dirty.add(user_id)
+        held = self._held.get()
+        if held is not None:
+            held.add(user_id)
+
+    @contextmanager
+    def hold(self) -> Iterator[None]:
+        """
+        Сессии, выданные внутри блока, на выходе снова помечаются изменёнными: хендлер правит поля
+        и после await, когда сброс на диск мог уже снять отметку. Оборачивает обработку апдейта.
+        """
+        held: Set[int] = set()
+        token = self._held.set(held)
+        try:
+            yield
+        finally:
+            self._held.reset(token)
+            self._dirty.update(held)
+
+    def get(self, user_id: int) -> BookingSession:
+        now = time.monotonic()
+        self._maybe_sweep(now)
+        session = self._sessions.get(user_id)
+        if session is None or now - self._touched[user_id] > self.ttl:
+            return self.reset(user_id)
+        # хендлеры меняют поля сессии напрямую, поэтому выданная сессия считается изменённой
+        self._touch(user_id, now)
+        return session
+
+    def reset(self, user_id: int) -> BookingSession:
+        now = time.monotonic()
+        self._sessions[user_id] = BookingSession()
+        self._touch(user_id, now)
+        while len(self._sessions) > self.max_size:
+            oldest, _ = self._sessions.popitem(last=False)
+            del self._touched[oldest]
+            self._dirty.add(oldest)
+        return self._sessions[user_id]
+
+    def pop(self, user_id: int) -> Optional[BookingSession]:
+        self._touched.pop(user_id, None)
+        self._dirty.add(user_id)
+        return self._sessions.pop(user_id, None)
+
+    def _maybe_sweep(self, now: float) -> None:
+        if now - self._last_sweep >= self.sweep_interval:
+            self.sweep(now)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Удаляет сессии без обращений дольше ttl; возвращает, сколько удалено."""
+        now = time.monotonic() if now is None else now
+        self._last_sweep = now
+        removed = 0
+        for user_id in list(self._sessions):
+            if now - self._touched[user_id] <= self.ttl:
+                break
+            del self._sessions[user_id]
+            del self._touched[user_id]
+            # удаление тоже уходит в журнал, иначе после рестарта сессия вернётся до следующего снапшота
+            self._dirty.add(user_id)
+            removed += 1
+        return removed
+
+    # На диск время обращения пишется по настенным часам: monotonic после рестарта начинается заново.
+    def _record(self, user_id: int, offset: float) -> Dict:
+        return {"touched": self._touched[user_id] + offset, "session": asdict(self._sessions[user_id])}
+
+    def changes(self) -> Dict[int, Optional[Dict]]:
+        offset = time.time() - time.monotonic()
+        dirty, self._dirty = self._dirty, set()
+        return {user_id: self._record(user_id, offset) if user_id in self._sessions else None for user_id in dirty}
+
+    def requeue(self, user_ids: Iterable[int]) -> None:
+        self._dirty.update(user_ids)
+
+    def dump(self) -> Dict[int, Dict]:
+        offset = time.time() - time.monotonic()
+        return {user_id: self._record(user_id, offset) for user_id in self._sessions}
+
+    def restore(self, values: Dict[int, Dict]) -> None:
+        offset = time.time() - time.monotonic()
+        now = time.monotonic()
+        records = sorted(values.items(), key=lambda x: x[1]["touched"])
+        for user_id, record in records[-self.max_size:]:
+            touched = record["touched"] - offset
+            if now - touched > self.ttl:
+                continue
+            # поля, которых уже нет в BookingSession (файл от старой версии), пропускаем
+            data = {k: v for k, v in record["session"].items() if k in _SESSION_FIELDS}
+            self._sessions[user_id] = BookingSession(**data)
+            self._touched[user_id] = touched
+
+
+class TrackedDict(dict):
+    """dict, который помнит изменённые ключи. Вложенные значения заменяются целиком, а не правятся на месте."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._dirty: Set[int] = set()
+
+    def __setitem__(self, key: int, value: Any) -> None:
+        super().__setitem__(key, value)
+        self._dirty.add(key)
+
+    def __delitem__(self, key: int) -> None:
+        super().__delitem__(key)
+        self._dirty.add(key)
+
+    def pop(self, key: int, *default: Any) -> Any:
+        self._dirty.add(key)
+        return super().pop(key, *default)
+
+    def changes(self) -> Dict[int, Optional[Any]]:
+        dirty, self._dirty = self._dirty, set()
+        return {key: self.get(key) for key in dirty}
+
+    def requeue(self, keys: Iterable[int]) -> None:
+        self._dirty.update(keys)
+
+    def dump(self) -> Dict[int, Any]:
+        return dict(self)
+
+    def restore(self, values: Dict[int, Any]) -> None:
+        super().update(values)
+
+
+class SessionJournal:
+    """
+    Write-behind для состояния диалогов: хендлеры меняют его только в памяти, а раз в interval
+    секунд изменённые ключи дописываются в журнал (sessions.journal) одной пачкой. Как у журнальной
+    очереди, после compact_bytes журнал сворачивается в снапшот (sessions.json) — тем же коммитом
+    через txn-план. При старте снапшот читается и журнал проигрывается поверх.
+    """
+
+    def __init__(self, path: Path, compact_bytes: int = 256 * 1024) -> None:
+        self.path = path
+        self.journal_path = path.with_suffix(".journal")
+        self.txn_path = path.with_suffix(".txn")
+        self.compact_bytes = compact_bytes
+        self._sources: Dict[str, Any] = {}
+        self._write_lock = threading.Lock()
+        self._stop = asyncio.Event()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        recover_writes(self.txn_path)
+        self._loaded = self._replay()
+        try:
+            self._journal_size = self.journal_path.stat().st_size
+        except FileNotFoundError:
+            self._journal_size = 0
+
+    def _replay(self) -> Dict[str, Dict[int, Any]]:
+        state: Dict[str, Dict[int, Any]] = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            snapshot = {}
+        for namespace, values in snapshot.items():
+            state[namespace] = {int(key): value for key, value in values.items()}
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return state
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # недописанная последняя строка после падения
+                log.warning("Sessions %s: skipped broken record", self.journal_path)
+                continue
+            values = state.setdefault(record["ns"], {})
+            if record["value"] is None:
+                values.pop(record["key"], None)
+            else:
+                values[record["key"]] = record["value"]
+        return state
+
+    def register(self, namespace: str, source: Any) -> None:
+        """
+        Подключает хранилище и сразу отдаёт ему сохранённое состояние. source.changes() — ключи,
+        изменённые с прошлого сброса (None — ключ удалён), source.dump() — всё состояние для снапшота,
+        source.requeue(keys) — вернуть ключи в изменённые, если сброс не удался.
+        """
+        self._sources[namespace] = source
+        source.restore(self._loaded.pop(namespace, {}))
+
+    def _collect(self) -> Tuple[FileWrites, Dict[str, Set[int]], int]:
+        """
+        Снимает изменения для сброса: файлы для записи, снятые ключи по namespace и размер журнала
+        после записи. Ключи возвращаются в source через _requeue, если запись не удалась.
+        """
+        # вызывается из event loop: хендлеры меняют состояние там же, поэтому снимок согласован
+        changes = {namespace: source.changes() for namespace, source in self._sources.items()}
+        taken = {namespace: set(values) for namespace, values in changes.items() if values}
+        lines = [
+            json.dumps({"ns": namespace, "key": key, "value": value}, ensure_ascii=False) + "\n"
+            for namespace, values in changes.items()
+            for key, value in values.items()
+        ]
+        if not lines:
+            return {}, taken, self._journal_size
+        text = "".join(lines)
+        size = self._journal_size + len(text.encode("utf-8"))
+        if size < self.compact_bytes:
+            return {self.journal_path: (text, True)}, taken, size
+        snapshot = {
+            namespace: {str(key): value for key, value in source.dump().items()}
+            for namespace, source in self._sources.items()
+        }
+        writes = {
+            self.path: (json.dumps(snapshot, ensure_ascii=False), False),
+            self.journal_path: ("", False),
+        }
+        return writes, taken, 0
+
+    def _requeue(self, taken: Dict[str, Set[int]]) -> None:
+        for namespace, keys in taken.items():
+            self._sources[namespace].requeue(keys)
+
+    def _write(self, writes: FileWrites) -> None:
+        with self._write_lock:
+            # сворачивание, прерванное прошлой ошибкой, доводится до конца раньше новой записи
+            recover_writes(self.txn_path)
+            plan = prepare_writes(writes)
+            multi = len(writes) > 1
+            if multi:
+                atomic_write_text(self.txn_path, json.dumps(plan, ensure_ascii=False))
+            try:
+                apply_writes(plan)
+            except OSError:
+                if not multi:
+                    # недописанную строку обрезаем, иначе следующая пачка склеится с ней
+                    for path, offset, _ in plan["append"]:
+                        with open(path, "ab") as f:
+                            f.truncate(offset)
+                raise
+            if multi:
+                self.txn_path.unlink()
+
+    def flush(self) -> None:
+        writes, taken, size = self._collect()
+        if not writes:
+            return
+        try:
+            self._write(writes)
+        except OSError:
+            self._requeue(taken)
+            raise
+        self._journal_size = size
+
+    async def run(self, interval: float) -> None:
+        """Фоновый сброс раз в interval секунд; после stop() сбрасывает остаток и завершается."""
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            writes, taken, size = self._collect()
+            if not writes:
+                continue
+            try:
+                await asyncio.to_thread(self._write, writes)
+            except OSError:
+                # изменения не потеряны: ключи снова помечены и уйдут со следующим сбросом
+                log.exception("Sessions: flush to %s failed", self.journal_path)
+                self._requeue(taken)
+                continue
+            self._journal_size = size
+
+    def stop(self) -> None:
+        self._stop.set()
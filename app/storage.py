@@ -1,23 +1,615 @@
+import bisect
+import functools
+import hashlib
+import heapq
+import itertools
 import json
 import os
+import threading
+from concurrent.futures import Future
+from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from app.services.booking import get_service_by_id, now_ekb
+from app.logger import get_logger
+from app.search import SearchIndex, TextIndex
+from app.services.booking import EKB_TZ, get_service_by_id, now_ekb
+from app.storage_async import AsyncStorageMixin
 
 
-class QueueStorage:
-    def __init__(self, path: Path, history_path: Path, reviews_path: Path) -> None:
+log = get_logger(__name__)
+
+# Версия формата файлов; каждое повышение — метод _migrate_v<N> у QueueStorage.
+SCHEMA_VERSION = 9
+HISTORY_DEFAULTS = {
+    "result_sent": False,
+    "result_payload": None,
+    "review_skipped_at": None,
+    "user_username": None,
+    "user_fullname": None,
+    "is_urgent": False,
+    "price": None,
+    "phone": None,
+}
+QUEUE_DEFAULTS = {
+    **HISTORY_DEFAULTS,
+    "payment_status": "pending",
+    "session_status": "pending",
+}
+REVIEW_DEFAULTS = {
+    "user_username": None,
+    "user_fullname": None,
+    "name": None,
+    "birth_date": None,
+    "order_created_at": None,
+    "order_id": None,
+}
+
+
+def locked(method):
+    """
+    Выполняет метод хранилища под его блокировкой (фоновые потоки не видят полузаписанных данных).
+    Когда завершается самый внешний такой вызов, дожидаемся, пока его изменения лягут на диск.
+    Если он упал посередине, накопленное им на диск не попадает, а память перечитывается с диска.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        local = self._local
+        outer = not getattr(local, "depth", 0)
+        while True:
+            if outer and self._stale:
+                self._recover()
+            try:
+                with self._lock:
+                    # пока ждали блокировку, могло упасть изменение в другом потоке
+                    if outer and self._stale:
+                        continue
+                    state = self._pending_state() if outer else None
+                    local.depth = getattr(local, "depth", 0) + 1
+                    try:
+                        result = method(self, *args, **kwargs)
+                    except BaseException:
+                        if outer:
+                            self._abandon(state)
+                        raise
+                    finally:
+                        local.depth -= 1
+            except BaseException:
+                if outer and self._stale:
+                    self._recover()
+                raise
+            break
+        if outer:
+            self._settle()
+        return result
+
+    return wrapper
+
+
+def format_user_request(item: Dict) -> str:
+    service = get_service_by_id(item.get("service_id", "")) or {"title": item.get("service_id", "")}
+    pay_status = item.get("payment_status")
+    pay_text = "оплачено" if pay_status == "paid" else "на проверке"
+    created = item.get("created_at", "")
+    created_date = created.split("T")[0] if "T" in created else created
+    return f"{service['title']}, {created_date}, {pay_text}"
+
+
+def format_user_order(item: Dict) -> str:
+    """Строка «Моих заявок»: позиция для заказов в очереди и статус расклада."""
+    text = format_user_request(item)
+    if item.get("result_sent"):
+        text += ", расклад отправлен"
+    elif item.get("session_status") == "done":
+        text += ", сеанс проведён"
+    if item.get("archive_id") is None and item.get("position"):
+        text = f"№{item['position']} в очереди — {text}"
+    return text
+
+
+def keyset_page(ahead: Iterator[Dict], behind: Iterator[Dict], limit: int, key: str, backward: bool = False) -> Dict:
+    """
+    Одна страница keyset-пагинации. ahead — записи от курсора в сторону листания, behind — в обратную
+    (достаточно одной, чтобы понять, есть ли куда вернуться). Курсоры next/prev — значения key
+    крайних записей страницы: они не зависят от пересчёта позиций.
+    """
+    items = list(itertools.islice(ahead, limit + 1))
+    more = len(items) > limit
+    items = items[:limit]
+    back = next(behind, None) is not None
+    if backward:
+        items.reverse()
+        more, back = back, more
+    return {
+        "items": items,
+        "next": items[-1][key] if more and items else None,
+        "prev": items[0][key] if back and items else None,
+    }
+
+
+def _copy(item: Optional[Dict]) -> Optional[Dict]:
+    # записи из кеша отдаём наружу копиями: правка результата не должна менять кеш и индексы без коммита
+    return None if item is None else dict(item)
+
+
+def sort_queue(data: List[Dict]) -> None:
+    # срочные вверх, сортируем по дате создания
+    data.sort(key=lambda x: (not x.get("is_urgent", False), x.get("created_at", "")))
+    for idx, item in enumerate(data, start=1):
+        item["position"] = idx
+
+
+def write_temp(path: Path, text: str) -> Path:
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp_path
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """Пишет во временный файл, fsync и rename — на диске либо старая, либо новая версия целиком."""
+    os.replace(write_temp(path, text), path)
+
+
+# Изменения файлов одного коммита: путь -> (текст, дописать в конец вместо замены файла).
+FileWrites = Dict[Path, Tuple[str, bool]]
+
+
+def prepare_writes(writes: FileWrites) -> Dict:
+    """Готовит план коммита: новые версии файлов уже лежат во временных файлах, осталось их подменить."""
+    plan: Dict[str, List] = {"replace": [], "append": []}
+    for path, (text, append) in writes.items():
+        if append:
+            try:
+                offset = path.stat().st_size
+            except FileNotFoundError:
+                offset = 0
+            plan["append"].append([str(path), offset, text])
+        else:
+            plan["replace"].append([str(write_temp(path, text)), str(path)])
+    return plan
+
+
+def apply_writes(plan: Dict) -> None:
+    # идемпотентно: повторное применение того же плана после падения даёт тот же результат
+    for tmp_path, path in plan["replace"]:
+        if os.path.exists(tmp_path):
+            os.replace(tmp_path, path)
+    for path, offset, text in plan["append"]:
+        with open(path, "ab") as f:
+            f.truncate(offset)
+            f.write(text.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def recover_writes(txn_path: Path) -> None:
+    """Доводит до конца коммит, прерванный падением: план в txn_path записан, но мог быть применён не весь."""
+    try:
+        with open(txn_path, "r", encoding="utf-8") as f:
+            plan = json.load(f)
+    except FileNotFoundError:
+        return
+    apply_writes(plan)
+    txn_path.unlink()
+    log.warning("Storage: redone interrupted commit %s", txn_path)
+
+
+class GroupCommitter:
+    """
+    Group commit: изменения, пришедшие в пределах window секунд, сбрасываются на диск одним
+    коммитом (не больше одной записи на файл), и все ожидающие получают результат одновременно.
+    """
+
+    def __init__(self, window: float, commit: Callable[[Dict[Path, Callable[[], FileWrites]]], None]) -> None:
+        self.window = window
+        self._commit = commit
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: Dict[Path, Callable[[], FileWrites]] = {}
+        self._futures: List[Future] = []
+        self._scheduled = False
+
+    def submit(self, renders: Dict[Path, Callable[[], FileWrites]]) -> Future:
+        future: Future = Future()
+        with self._lock:
+            # render сериализует актуальное состояние файла, поэтому одного на файл достаточно
+            for path, render in renders.items():
+                self._pending.setdefault(path, render)
+            self._futures.append(future)
+            if not self._scheduled:
+                self._scheduled = True
+                threading.Timer(self.window, self._flush).start()
+        return future
+
+    def drain(self) -> None:
+        """Дожидается, пока на диск лягут все уже отправленные изменения."""
+        self.submit({}).result()
+
+    def _flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                pending, futures = self._pending, self._futures
+                self._pending, self._futures, self._scheduled = {}, [], False
+            error: Optional[BaseException] = None
+            try:
+                self._commit(pending)
+            except Exception as exc:
+                log.exception("Group commit: failed to write %s", ", ".join(str(path) for path in pending))
+                error = exc
+            for future in futures:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(None)
+
+
+class IdSequence:
+    """
+    Монотонный счётчик идентификаторов (order_id, review_id) в отдельном файле рядом с данными.
+    Значение сохраняется в том же коммите, что и запись, которая использует номер,
+    поэтому после падения номера могут пропускаться, но никогда не повторяются.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        seed: Callable[[], int],
+        durable: Optional[Callable[[Path, Callable[[], FileWrites]], None]] = None,
+        key: str = "order_id",
+    ) -> None:
         self.path = path
+        self.key = key
+        self._seed = seed
+        self._durable = durable
+        self._value: Optional[int] = None
+
+    def _load(self) -> int:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return int(json.load(f)[self.key])
+        except FileNotFoundError:
+            # первый запуск: один раз берём максимум из уже существующих файлов
+            return self._seed()
+
+    def next(self) -> int:
+        if self._value is None:
+            self._value = self._load()
+        self._value += 1
+        if self._durable is not None:
+            self._durable(self.path, self._render)
+        else:
+            atomic_write_text(self.path, self._render()[self.path][0])
+        return self._value
+
+    def _render(self) -> FileWrites:
+        return {self.path: (json.dumps({self.key: self._value}), False)}
+
+
+class HistoryStats:
+    """
+    Накопительные итоги архива по срезам: total, service, day, month (дни и месяцы — по Екатеринбургу).
+    На ключ хранится [заказов, сумма известных цен, заказов без цены]: цена по умолчанию
+    подставляется только при чтении, поэтому итоги не зависят от default_price.
+    """
+
+    SCOPES = ("total", "service", "day", "month")
+
+    def __init__(self, data: Optional[Dict] = None) -> None:
+        self.data: Dict[str, Dict[str, List[int]]] = data or {scope: {} for scope in self.SCOPES}
+
+    @staticmethod
+    def buckets(item: Dict) -> List[Tuple[str, str]]:
+        result = [("total", ""), ("service", item.get("service_id") or "")]
+        stamp = item.get("archived_at") or item.get("created_at")
+        try:
+            moment = datetime.fromisoformat(stamp) if stamp else None
+        except ValueError:
+            moment = None
+        if moment is not None:
+            if moment.tzinfo is not None:
+                moment = moment.astimezone(EKB_TZ)
+            result += [("day", moment.date().isoformat()), ("month", moment.strftime("%Y-%m"))]
+        return result
+
+    def add(self, item: Dict) -> None:
+        price = item.get("price")
+        for scope, key in self.buckets(item):
+            row = self.data.setdefault(scope, {}).setdefault(key, [0, 0, 0])
+            row[0] += 1
+            if isinstance(price, int):
+                row[1] += price
+            else:
+                row[2] += 1
+
+    def rows(self) -> Iterator[Tuple[str, str, int, int, int]]:
+        for scope, keys in self.data.items():
+            for key, (orders, priced_sum, unpriced) in keys.items():
+                yield scope, key, orders, priced_sum, unpriced
+
+    def get(self, scope: str, key: str, default_price: int) -> Tuple[int, int]:
+        orders, priced_sum, unpriced = self.data.get(scope, {}).get(key, (0, 0, 0))
+        return orders, priced_sum + unpriced * default_price
+
+    def breakdown(self, scope: str, default_price: int, limit: Optional[int] = None) -> List[Tuple[str, int, int]]:
+        # периоды — от новых к старым, услуги — по ключу
+        keys = sorted(self.data.get(scope, {}), reverse=scope in ("day", "month"))
+        return [(key, *self.get(scope, key, default_price)) for key in keys[:limit]]
+
+
+class RecordIndex:
+    """Хеш-индексы по записям одного файла; при мутациях обновляются точечно, а не перестраиваются."""
+
+    def __init__(self, data: List[Dict], unique: Iterable[str], multi: Iterable[str] = ()) -> None:
+        self.data = data
+        self.unique: Dict[str, Dict] = {key: {} for key in unique}
+        self.multi: Dict[str, Dict] = {key: {} for key in multi}
+        for item in data:
+            self.add(item)
+
+    def add(self, item: Dict) -> None:
+        for key, index in self.unique.items():
+            value = item.get(key)
+            if value is not None:
+                # как и при линейном поиске, побеждает первая запись
+                index.setdefault(value, item)
+        for key, index in self.multi.items():
+            index.setdefault(item.get(key), []).append(item)
+
+    def remove(self, item: Dict) -> None:
+        for key, index in self.unique.items():
+            if index.get(item.get(key)) is item:
+                del index[item.get(key)]
+        for key, index in self.multi.items():
+            bucket = index.get(item.get(key), [])
+            bucket[:] = [x for x in bucket if x is not item]
+            if not bucket:
+                index.pop(item.get(key), None)
+
+    def get(self, key: str, value) -> Optional[Dict]:
+        return self.unique[key].get(value)
+
+    def get_all(self, key: str, value) -> List[Dict]:
+        return self.multi[key].get(value, [])
+
+
+class QueueLanes:
+    """
+    Очередь как две полосы — срочные и обычные, каждая отсортирована по (created_at, order_id).
+    Вставка и удаление — бинарный поиск; позиция не хранится в записи, а считается рангом.
+    """
+
+    def __init__(self, data: List[Dict]) -> None:
+        self.data = data
+        self.urgent: List[Tuple[str, int]] = []
+        self.normal: List[Tuple[str, int]] = []
+        self.items: Dict[int, Dict] = {}
+        # счётчики для фильтров списка: (service_id, payment_status, session_status) -> заказов
+        self.counts: Dict[Tuple, int] = {}
+        for item in data:
+            self.insert(item)
+
+    @staticmethod
+    def _count_key(item: Dict) -> Tuple:
+        return item.get("service_id"), item.get("payment_status"), item.get("session_status")
+
+    @staticmethod
+    def _key(item: Dict) -> Tuple[str, int]:
+        return item.get("created_at") or "", item["order_id"]
+
+    def _lane(self, item: Dict) -> List[Tuple[str, int]]:
+        return self.urgent if item.get("is_urgent") else self.normal
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def insert(self, item: Dict) -> None:
+        bisect.insort(self._lane(item), self._key(item))
+        self.items[item["order_id"]] = item
+        count_key = self._count_key(item)
+        self.counts[count_key] = self.counts.get(count_key, 0) + 1
+
+    def remove(self, item: Dict) -> None:
+        lane = self._lane(item)
+        key = self._key(item)
+        idx = bisect.bisect_left(lane, key)
+        if idx < len(lane) and lane[idx] == key:
+            del lane[idx]
+            count_key = self._count_key(item)
+            self.counts[count_key] -= 1
+            if not self.counts[count_key]:
+                del self.counts[count_key]
+        self.items.pop(item["order_id"], None)
+
+    def update(self, item: Dict, fields: Dict) -> None:
+        # статусы входят в ключ счётчиков, поэтому запись переставляется целиком
+        self.remove(item)
+        item.update(fields)
+        self.insert(item)
+
+    def count(
+        self,
+        service_id: Optional[str] = None,
+        payment_status: Optional[str] = None,
+        session_done: Optional[bool] = None,
+    ) -> int:
+        return sum(
+            n
+            for (service, payment, session), n in self.counts.items()
+            if (service_id is None or service == service_id)
+            and (payment_status is None or payment == payment_status)
+            and (session_done is None or (session == "done") == session_done)
+        )
+
+    def position(self, item: Dict) -> int:
+        rank = bisect.bisect_left(self._lane(item), self._key(item)) + 1
+        return rank if item.get("is_urgent") else len(self.urgent) + rank
+
+    def at(self, position: int) -> Optional[Dict]:
+        if 1 <= position <= len(self.urgent):
+            return self.items[self.urgent[position - 1][1]]
+        position -= len(self.urgent)
+        if 1 <= position <= len(self.normal):
+            return self.items[self.normal[position - 1][1]]
+        return None
+
+    def ordered(self) -> Iterator[Dict]:
+        for _, order_id in self.urgent:
+            yield self.items[order_id]
+        for _, order_id in self.normal:
+            yield self.items[order_id]
+
+
+class QueueStorage(AsyncStorageMixin):
+    def __init__(
+        self,
+        path: Path,
+        history_path: Path,
+        reviews_path: Path,
+        cached: bool = True,
+        sequence_path: Optional[Path] = None,
+        commit_window: float = 0.005,
+    ) -> None:
+        self.path = path
+        # history_path — прежний единый файл архива, теперь он нужен только для миграции
         self.history_path = history_path
+        self.history_dir = history_path.with_suffix("")
+        self.manifest_path = self.history_dir / "manifest.json"
+        self.stats_path = self.history_dir / "stats.json"
+        # тексты раскладов: data/blobs/<sha256>.json, в записи заказа остаётся только result_blob
+        self.blobs_dir = path.parent / "blobs"
+        # reviews_path — прежний JSON-файл отзывов, сами отзывы дописываются в журнал reviews.ndjson
         self.reviews_path = reviews_path
+        self.reviews_log = reviews_path.with_suffix(".ndjson")
+        # cached=True: держим файлы в памяти и перечитываем только если файл изменился на диске
+        self.cached = cached
+        self._cache: Dict[Path, Tuple[Tuple[int, int, int], List[Dict]]] = {}
+        self._lock = threading.RLock()
+        # коммиты применяются строго по одному, иначе старая версия файла может лечь поверх новой
+        self._commit_lock = threading.Lock()
+        self._local = threading.local()
+        # до конца миграции пишем синхронно, group commit включается в конце __init__
+        self._committer: Optional[GroupCommitter] = None
+        self._indexes: Dict[Path, RecordIndex] = {}
+        self._lanes: Optional[QueueLanes] = None
+        # поиск по заказам очереди и архива; строится при первом запросе и дальше обновляется точечно
+        self._search: Optional[SearchIndex] = None
+        self._search_data: Optional[List[Dict]] = None
+        self._review_search: Optional[TextIndex] = None
+        self._review_search_data: Optional[List[Dict]] = None
+        # индекс смещений архива: archive_id / order_id -> (сегмент, номер строки, смещение, длина)
+        self._offsets: Optional[Tuple[Dict[int, Tuple], Dict[int, Tuple]]] = None
+        # ключи архива по дате создания: (created_at, archive_id, service_id), строится вместе с индексом смещений
+        self._timeline: List[Tuple[str, int, Optional[str]]] = []
+        # user_id -> archive_id заказов пользователя в архиве, в порядке архивации
+        self._archive_users: Dict[int, List[int]] = {}
+        self._segment_bytes: Dict[str, int] = {}
+        # несохранённые строки сегментов архива (запись, строка индекса) и сегменты, которые нужно переписать целиком
+        self._segment_lines: Dict[Path, List[Tuple[str, str]]] = {}
+        self._segment_rewrites: set = set()
+        # строки, которые ещё не дописаны в журналы (отзывы)
+        self._log_lines: Dict[Path, List[str]] = {}
+        self._manifest_rebuilt = False
+        # файлы из неудавшегося коммита: повторяются со следующим коммитом
+        self._failed: Dict[Path, Callable[[], FileWrites]] = {}
+        self._sequence = IdSequence(
+            sequence_path or path.with_suffix(".seq"),
+            seed=self._seed_order_id,
+            durable=self._durable,
+        )
+        self._review_sequence = IdSequence(
+            self.reviews_log.with_suffix(".seq"),
+            seed=lambda: max((x["review_id"] for x in self._read_reviews() if isinstance(x.get("review_id"), int)), default=0),
+            durable=self._durable,
+            key="review_id",
+        )
         self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.history_dir.mkdir(parents=True, exist_ok=True)
+        # план незавершённого коммита из нескольких файлов (см. _commit)
+        self.txn_path = path.with_suffix(".txn")
+        recover_writes(self.txn_path)
         if not self.path.exists():
             self._write([])
-        if not self.history_path.exists():
-            self._write_history([])
-        if not self.reviews_path.exists():
-            self._write_reviews([])
+        self.meta_path = path.with_name(path.stem + ".meta.json")
+        self.migrate()
+        self._drop_orphan_segments()
+        if commit_window > 0:
+            self._committer = GroupCommitter(commit_window, self._commit)
+
+    def _signature(self, path: Path) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _cached(self, path: Path) -> Optional[List[Dict]]:
+        # без кеша файл перечитывается на каждый вызов, но внутри одного изменения данные общие
+        if path not in self._cache or (not self.cached and not getattr(self._local, "depth", 0)):
+            return None
+        signature, data = self._cache[path]
+        if signature != self._signature(path):
+            return None
+        return data
+
+    def _remember(self, path: Path, data: List[Dict]) -> None:
+        self._cache[path] = (self._signature(path), data)
+
+    def _index(self, path: Path, data: List[Dict], unique: Iterable[str], multi: Iterable[str] = ()) -> RecordIndex:
+        # индекс перестраивается только когда список заново прочитан с диска
+        with self._lock:
+            index = self._indexes.get(path)
+            if index is None or index.data is not data:
+                index = RecordIndex(data, unique, multi)
+                self._indexes[path] = index
+            return index
+
+    def _queue_index(self) -> RecordIndex:
+        return self._index(self.path, self._read(), ("order_id",), ("user_id",))
+
+    def _search_index(self) -> SearchIndex:
+        # ключи: ("live", order_id) и ("arch", archive_id)
+        with self._lock:
+            data = self._read()
+            if self._search is None or self._search_data is not data:
+                index = SearchIndex()
+                for item in data:
+                    index.add(("live", item["order_id"]), item)
+                for item in self._read_history():
+                    index.add(("arch", item.get("archive_id")), item)
+                self._search, self._search_data = index, data
+            return self._search
+
+    def _review_search_index(self) -> TextIndex:
+        with self._lock:
+            data = self._read_reviews()
+            if self._review_search is None or self._review_search_data is not data:
+                index = TextIndex()
+                for item in data:
+                    index.add(item.get("review_id"), item.get("text") or "")
+                self._review_search, self._review_search_data = index, data
+            return self._review_search
+
+    def _queue_lanes(self) -> QueueLanes:
+        with self._lock:
+            data = self._read()
+            if self._lanes is None or self._lanes.data is not data:
+                self._lanes = QueueLanes(data)
+            return self._lanes
+
+    def _with_position(self, item: Optional[Dict], position: Optional[int] = None) -> Optional[Dict]:
+        # наружу отдаём копию с вычисленной позицией, сама запись позицию не хранит
+        if item is None:
+            return None
+        if position is None:
+            position = self._queue_lanes().position(item)
+        return dict(item, position=position)
+
+    def _reviews_index(self) -> RecordIndex:
+        return self._index(self.reviews_log, self._read_reviews(), ("order_id", "review_id"), ("service_id",))
 
     def _max_order_id_from_path(self, path: Path) -> int:
         try:
@@ -31,162 +623,567 @@ class QueueStorage:
                 max_id = max(max_id, item["order_id"])
         return max_id
 
-    def _read(self) -> List[Dict]:
-        try:
-            with open(self.path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
-        dirty = False
-        max_order_id = max(
+    def _seed_order_id(self) -> int:
+        # очередь берём через _read(): у журнального бэкенда это снапшот вместе с проигранным журналом
+        return max(
+            max((x["order_id"] for x in self._read() if isinstance(x.get("order_id"), int)), default=0),
             self._max_order_id_from_path(self.history_path),
-            0,
+            max((x["order_id"] for x in self._read_history() if isinstance(x.get("order_id"), int)), default=0),
         )
-        for item in data:
-            if isinstance(item.get("order_id"), int):
-                max_order_id = max(max_order_id, item["order_id"])
-        for idx, item in enumerate(data, start=1):
-            if "position" not in item:
-                item["position"] = idx
-                dirty = True
-            if "order_id" not in item:
-                max_order_id += 1
-                item["order_id"] = max_order_id
-                dirty = True
-            if "result_sent" not in item:
-                item["result_sent"] = False
-                dirty = True
-            if "result_payload" not in item:
-                item["result_payload"] = None
-                dirty = True
-            if "review_skipped_at" not in item:
-                item["review_skipped_at"] = None
-                dirty = True
-            if "payment_status" not in item:
-                item["payment_status"] = "pending"
-                dirty = True
-            if "session_status" not in item:
-                item["session_status"] = "pending"
-                dirty = True
-            if "user_username" not in item:
-                item["user_username"] = None
-                dirty = True
-            if "user_fullname" not in item:
-                item["user_fullname"] = None
-                dirty = True
-            if "is_urgent" not in item:
-                item["is_urgent"] = False
-                dirty = True
-            if "price" not in item:
-                item["price"] = None
-                dirty = True
-            if "phone" not in item:
-                item["phone"] = None
-                dirty = True
-        # срочные вверх, сортируем по дате создания
-        data.sort(key=lambda x: (not x.get("is_urgent", False), x.get("created_at", "")))
-        for idx, item in enumerate(data, start=1):
-            item["position"] = idx
-        dirty = True  # всегда сохраняем после нормализации
-        if dirty:
-            self._write(data)
-        return data
+
+    def _load(self, path: Path) -> List[Dict]:
+        # после миграции чтение — это только разбор JSON, без нормализации полей
+        cached = self._cached(path)
+        if cached is not None:
+            return cached
+        with self._lock:
+            cached = self._cached(path)
+            if cached is not None:
+                return cached
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    if path.suffix == ".ndjson":
+                        data = [json.loads(line) for line in f if line.strip()]
+                    else:
+                        data = json.load(f)
+            except FileNotFoundError:
+                return []
+            except json.JSONDecodeError:
+                # битый файл нельзя считать пустым — иначе следующая запись затрёт данные
+                if path in self._cache:
+                    log.error("Storage file %s is corrupted, serving last known state", path)
+                    return self._cache[path][1]
+                log.error("Storage file %s is corrupted", path)
+                raise
+            # без кеша чтение вне изменения не трогает общую копию: там могут быть ещё не сохранённые правки
+            if self.cached or getattr(self._local, "depth", 0):
+                self._remember(path, data)
+            return data
+
+    def _batch(self) -> Dict[Path, Callable[[], FileWrites]]:
+        batch = getattr(self._local, "batch", None)
+        if batch is None:
+            batch = self._local.batch = {}
+        return batch
+
+    def _submit(self) -> List[Future]:
+        # всё, что накопил внешний вызов, уходит на диск одним коммитом
+        batch, self._local.batch = self._batch(), {}
+        if not batch:
+            return []
+        if self._committer is not None:
+            return [self._committer.submit(batch)]
+        self._commit(batch)
+        return []
+
+    def _settle(self) -> None:
+        if getattr(self._local, "defer", False):
+            return
+        for future in self._submit():
+            future.result()
+
+    def _call_for_async(self, method: Callable, *args, **kwargs):
+        # асинхронный фасад ждёт записи сам, уже отпустив блокировку писателей
+        self._local.defer = True
+        try:
+            result = method(*args, **kwargs)
+        finally:
+            self._local.defer = False
+        return result, self._submit()
+
+    def _durable(self, path: Path, render: Callable[[], FileWrites]) -> None:
+        """Запоминает, что файл нужно сохранить; render вызывается при коммите и сериализует актуальное состояние."""
+        if not getattr(self._local, "depth", 0):
+            self._commit({path: render})
+        else:
+            self._batch().setdefault(path, render)
+
+    def _commit(self, renders: Dict[Path, Callable[[], FileWrites]]) -> None:
+        """
+        Сохраняет несколько файлов атомарно: новые версии пишутся во временные файлы, план подмены
+        фиксируется в txn-файле и только потом применяется. После падения план доигрывается при старте.
+        """
+        with self._commit_lock:
+            with self._lock:
+                renders = {**self._failed, **renders}
+                self._failed = {}
+                # render забирает строки из очередей дозаписи; при ошибке они вернутся в начало очередей
+                state = self._pending_state()
+                writes: FileWrites = {}
+                for render in renders.values():
+                    writes.update(render())
+            if not writes:
+                return
+            plan = None
+            try:
+                plan = prepare_writes(writes)
+                multi = len(writes) > 1
+                if multi:
+                    atomic_write_text(self.txn_path, json.dumps(plan, ensure_ascii=False))
+                with self._lock:
+                    apply_writes(plan)
+                    # в памяти могло появиться более новое состояние — обновляем только подпись файла
+                    for path in writes:
+                        entry = self._cache.get(path)
+                        if entry is not None:
+                            self._cache[path] = (self._signature(path), entry[1])
+                if multi:
+                    self.txn_path.unlink()
+            except Exception:
+                self._undo_writes(plan)
+                with self._lock:
+                    # память остаётся верной: откат файлов не должен выглядеть как правка на диске извне
+                    for path in writes:
+                        entry = self._cache.get(path)
+                        if entry is not None:
+                            self._cache[path] = (self._signature(path), entry[1])
+                    self._requeue(state, renders)
+                    self._failed.update(renders)
+                raise
+
+    def _undo_writes(self, plan: Optional[Dict]) -> None:
+        """
+        Откат неудавшегося коммита: дозаписанные файлы обрезаются до прежней длины (иначе смещения
+        в .idx разъедутся с файлом), неприменённые временные файлы и план удаляются. Уже подменённые
+        файлы остаются — это полные версии из памяти, их перезапишет повтор коммита.
+        """
+        if plan is None:
+            return
+        for tmp_path, _ in plan["replace"]:
+            Path(tmp_path).unlink(missing_ok=True)
+        for path, offset, _ in plan["append"]:
+            try:
+                with open(path, "ab") as f:
+                    f.truncate(offset)
+            except OSError:
+                log.exception("Storage: failed to roll back append to %s", path)
+        self.txn_path.unlink(missing_ok=True)
+
+    def _pending_state(self) -> Tuple:
+        return (
+            {path: list(lines) for path, lines in self._segment_lines.items()},
+            set(self._segment_rewrites),
+            {path: list(lines) for path, lines in self._log_lines.items()},
+        )
+
+    def _requeue(self, state: Tuple, paths: Iterable[Path]) -> None:
+        # строки неудавшегося коммита встают перед теми, что успели добавиться после него
+        segment_lines, rewrites, log_lines = state
+        for path in paths:
+            if path in segment_lines:
+                self._segment_lines[path] = segment_lines[path] + self._segment_lines.get(path, [])
+            if path in rewrites:
+                self._segment_rewrites.add(path)
+            if path in log_lines:
+                self._log_lines[path] = log_lines[path] + self._log_lines.get(path, [])
+
+    def _abandon(self, state: Tuple) -> None:
+        # вызов держал блокировку всё время, поэтому снимок на входе — ровно очереди без его строк
+        self._local.batch = {}
+        self._segment_lines, self._segment_rewrites, self._log_lines = state
+        self._stale = True
+
+    def _recover(self) -> None:
+        # сначала на диск уходят коммиты других вызовов, потом память перечитывается с диска
+        if self._committer is not None:
+            try:
+                self._committer.drain()
+            except Exception:
+                pass  # ошибка уже в логе group commit, файлы повторятся со следующим коммитом
+        with self._lock:
+            if self._stale:
+                self._invalidate()
+                self._stale = False
+                log.warning("Storage %s: failed change discarded, state reloaded from disk", self.path)
+
+    def _invalidate(self) -> None:
+        """Сбрасывает всё состояние в памяти: дальше оно заново читается с диска."""
+        self._cache.clear()
+        self._indexes.clear()
+        self._lanes = None
+        self._search = self._search_data = None
+        self._review_search = self._review_search_data = None
+        self._offsets = None
+        self._timeline = []
+        self._archive_users = {}
+        self._segment_bytes.clear()
+        self._segment_lines.clear()
+        self._segment_rewrites.clear()
+        self._log_lines.clear()
+        self._failed.clear()
+
+    def _render_file(self, path: Path) -> FileWrites:
+        return {path: (json.dumps(self._cache[path][1], ensure_ascii=False, indent=2), False)}
+
+    def _write_file(self, path: Path, data: List[Dict]) -> None:
+        self._remember(path, data)
+        self._durable(path, lambda: self._render_file(path))
+
+    def _read(self) -> List[Dict]:
+        return self._load(self.path)
 
     def _write(self, data: List[Dict]) -> None:
-        with open(self.path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        self._write_file(self.path, data)
+
+    def _commit_queue(self, data: List[Dict], record: Dict) -> None:
+        """Сохраняет очередь после изменения; record — краткое описание мутации (для журнала)."""
+        self._write(data)
+
+    def _segment_path(self, name: str) -> Path:
+        return self.history_dir / f"{name}.ndjson"
+
+    def _history_manifest(self) -> Dict:
+        manifest = self._cached(self.manifest_path)
+        if not manifest:
+            with self._lock:
+                try:
+                    manifest = self._load(self.manifest_path)
+                except json.JSONDecodeError:
+                    manifest = None
+                if not manifest:
+                    # манифест потерян или битый: восстанавливаем по файлам сегментов, а не считаем архив пустым
+                    manifest = self._rebuild_manifest()
+                    self._remember(self.manifest_path, manifest)
+        return manifest
+
+    def _rebuild_manifest(self) -> Dict:
+        segments = []
+        for path in self.history_dir.glob("*.ndjson"):
+            month, _, seq = path.stem.rpartition(".")
+            if not month or not seq.isdigit():
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                count = sum(1 for line in f if line.strip())
+            segments.append({"name": path.stem, "month": month, "count": count})
+        segments.sort(key=lambda segment: (segment["month"], int(segment["name"].rpartition(".")[2])))
+        seq = max((int(segment["name"].rpartition(".")[2]) for segment in segments), default=0)
+        if segments:
+            self._manifest_rebuilt = True
+            log.warning("History manifest %s rebuilt from %s segments", self.manifest_path, len(segments))
+        return {"segments": segments, "segment_seq": seq}
+
+    def _history_parts(self) -> List[List[Dict]]:
+        return [self._load(self._segment_path(segment["name"])) for segment in self._history_manifest()["segments"]]
 
     def _read_history(self) -> List[Dict]:
+        """Весь архив, старые записи первыми; обходит все сегменты."""
+        return [item for part in self._history_parts() for item in part]
+
+    def _history_total(self) -> int:
+        return sum(segment["count"] for segment in self._history_manifest()["segments"])
+
+    def _history_tail(self, limit: int) -> List[Dict]:
+        # последние записи, новые первыми: читаем сегменты с конца, пока не наберём limit
+        result: List[Dict] = []
+        for segment in reversed(self._history_manifest()["segments"]):
+            if len(result) >= limit:
+                break
+            part = self._load(self._segment_path(segment["name"]))
+            result.extend(reversed(part[-(limit - len(result)):]))
+        return result
+
+    def _offsets_path(self, name: str) -> Path:
+        return self.history_dir / f"{name}.idx"
+
+    def _history_offsets(self) -> Tuple[Dict[int, Tuple], Dict[int, Tuple]]:
+        # индексы сегментов маленькие (строка на запись), читаем их все один раз
+        with self._lock:
+            if self._offsets is None:
+                by_archive: Dict[int, Tuple] = {}
+                by_order: Dict[int, Tuple] = {}
+                timeline = []
+                users: Dict[int, List[int]] = {}
+                for segment in self._history_manifest()["segments"]:
+                    try:
+                        with open(self._offsets_path(segment["name"]), "r", encoding="utf-8") as f:
+                            rows = [json.loads(line) for line in f if line.strip()]
+                    except FileNotFoundError:
+                        rows = []
+                    for row in rows:
+                        archive_id, order_id, line, offset, length = row[:5]
+                        entry = (segment["name"], line, offset, length)
+                        by_archive.setdefault(archive_id, entry)
+                        by_order.setdefault(order_id, entry)
+                        if len(row) < 8:
+                            # индекс старого формата без даты, услуги и пользователя — берём их из самой записи
+                            record = self._load(self._segment_path(segment["name"]))[line]
+                            row = row[:5] + [record.get("created_at") or "", record.get("service_id"), record.get("user_id")]
+                        timeline.append((row[5], archive_id, row[6]))
+                        users.setdefault(row[7], []).append(archive_id)
+                timeline.sort()
+                self._timeline = timeline
+                self._archive_users = users
+                self._offsets = (by_archive, by_order)
+            return self._offsets
+
+    @staticmethod
+    def _index_row(item: Dict, line: int, offset: int, length: int) -> str:
+        row = [item.get("archive_id"), item.get("order_id"), line, offset, length]
+        row += [item.get("created_at") or "", item.get("service_id"), item.get("user_id")]
+        return json.dumps(row, ensure_ascii=False) + "\n"
+
+    def _index_entry(self, segment: str, item: Dict, line: int, offset: int, length: int) -> str:
+        by_archive, by_order = self._history_offsets()
+        entry = (segment, line, offset, length)
+        by_archive.setdefault(item.get("archive_id"), entry)
+        by_order.setdefault(item.get("order_id"), entry)
+        bisect.insort(self._timeline, (item.get("created_at") or "", item.get("archive_id"), item.get("service_id")))
+        self._archive_users.setdefault(item.get("user_id"), []).append(item.get("archive_id"))
+        return self._index_row(item, line, offset, length)
+
+    def _read_archived(self, entry: Optional[Tuple]) -> Optional[Dict]:
+        """Одна запись архива: из памяти, если сегмент уже загружен, иначе seek по смещению без разбора остального."""
+        if entry is None:
+            return None
+        name, line, offset, length = entry
+        path = self._segment_path(name)
+        cached = self._cache.get(path)
+        if cached is not None:
+            return dict(cached[1][line])
+        with open(path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.read(length))
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blobs_dir / f"{digest}.json"
+
+    def _put_blob(self, payload: Dict) -> str:
+        """Сохраняет payload под его sha256 (одинаковые тексты — один файл) и возвращает ключ."""
+        text = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        path = self._blob_path(digest)
+        if not path.exists():
+            self.blobs_dir.mkdir(parents=True, exist_ok=True)
+            # тем же коммитом, что и запись со ссылкой на него
+            self._durable(path, lambda: {path: (text, False)})
+        return digest
+
+    def _read_blob(self, digest: str) -> Optional[Dict]:
         try:
-            with open(self.history_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            data = []
-        dirty = False
-        max_order_id = max(
-            self._max_order_id_from_path(self.path),
-            0,
-        )
-        for item in data:
-            if isinstance(item.get("order_id"), int):
-                max_order_id = max(max_order_id, item["order_id"])
-        for idx, item in enumerate(data, start=1):
-            if "archive_id" not in item:
-                item["archive_id"] = idx
-                dirty = True
-            if "order_id" not in item:
-                max_order_id += 1
-                item["order_id"] = max_order_id
-                dirty = True
-            if "result_sent" not in item:
-                item["result_sent"] = False
-                dirty = True
-            if "result_payload" not in item:
-                item["result_payload"] = None
-                dirty = True
-            if "review_skipped_at" not in item:
-                item["review_skipped_at"] = None
-                dirty = True
-            if "user_username" not in item:
-                item["user_username"] = None
-                dirty = True
-            if "user_fullname" not in item:
-                item["user_fullname"] = None
-                dirty = True
-            if "is_urgent" not in item:
-                item["is_urgent"] = False
-                dirty = True
-            if "price" not in item:
-                item["price"] = None
-                dirty = True
-            if "phone" not in item:
-                item["phone"] = None
-                dirty = True
-        if dirty:
-            self._write_history(data)
-        return data
+            with open(self._blob_path(digest), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            log.warning("Blob %s is missing in %s", digest, self.blobs_dir)
+            return None
+
+    def _history_record(self, order_id: int) -> Optional[Tuple[Dict, Path]]:
+        # для правки нужна живая запись из сегмента, поэтому сегмент загружается целиком
+        entry = self._history_offsets()[1].get(order_id)
+        if entry is None:
+            return None
+        path = self._segment_path(entry[0])
+        return self._load(path)[entry[1]], path
 
-    def _write_history(self, data: List[Dict]) -> None:
-        with open(self.history_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    def _append_history(self, items: List[Dict]) -> None:
+        """Дописывает записи в сегмент текущего месяца; новый месяц — новый сегмент в манифесте."""
+        # итоги берутся до записи: если их пересчитывают по архиву, новая пачка не должна попасть туда дважды
+        stats = self._history_stats_data()
+        manifest = self._history_manifest()
+        segments = manifest["segments"]
+        for item in items:
+            month = (item.get("archived_at") or item.get("created_at") or "")[:7]
+            if not segments or segments[-1]["month"] < month:
+                manifest["segment_seq"] += 1
+                segments.append({"name": f"{month}.{manifest['segment_seq']}", "month": month, "count": 0})
+                self._remember(self._segment_path(segments[-1]["name"]), [])
+            segment = segments[-1]
+            name = segment["name"]
+            path = self._segment_path(name)
+            part = self._load(path)
+            if name not in self._segment_bytes:
+                self._segment_bytes[name] = path.stat().st_size if path.exists() else 0
+            record = json.dumps(item, ensure_ascii=False) + "\n"
+            size = len(record.encode("utf-8"))
+            index_line = self._index_entry(name, item, len(part), self._segment_bytes[name], size)
+            self._segment_bytes[name] += size
+            part.append(item)
+            segment["count"] += 1
+            if self._search is not None:
+                self._search.add(("arch", item.get("archive_id")), item)
+            self._segment_lines.setdefault(path, []).append((record, index_line))
+            self._durable(path, lambda name=name: self._render_segment(name))
+        self._write_file(self.manifest_path, manifest)
+        for item in items:
+            stats.add(item)
+        self._write_file(self.stats_path, stats.data)
+
+    def _history_stats_data(self) -> HistoryStats:
+        data = self._load(self.stats_path)
+        if not data:
+            # файл итогов потерян — пересчитываем по архиву, на диск он попадёт со следующим архивированием
+            with self._lock:
+                data = self._load(self.stats_path)
+                if not data:
+                    data = self._build_history_stats().data
+                    self._remember(self.stats_path, data)
+        return HistoryStats(data)
+
+    def _build_history_stats(self) -> HistoryStats:
+        stats = HistoryStats()
+        for item in self._read_history():
+            stats.add(item)
+        return stats
+
+    def _rewrite_history(self, path: Path) -> None:
+        # правка уже заархивированной записи — редкий случай, сегмент и его индекс переписываются целиком
+        self._segment_rewrites.add(path)
+        self._durable(path, lambda: self._render_segment(path.stem))
+
+    def _render_segment(self, name: str) -> FileWrites:
+        path = self._segment_path(name)
+        lines = self._segment_lines.pop(path, [])
+        if path in self._segment_rewrites:
+            self._segment_rewrites.discard(path)
+            records, index_lines, offset = [], [], 0
+            for line, item in enumerate(self._cache[path][1]):
+                record = json.dumps(item, ensure_ascii=False) + "\n"
+                size = len(record.encode("utf-8"))
+                records.append(record)
+                index_lines.append(self._index_row(item, line, offset, size))
+                if self._offsets is not None:
+                    entry = (name, line, offset, size)
+                    self._offsets[0][item.get("archive_id")] = entry
+                    self._offsets[1][item.get("order_id")] = entry
+                offset += size
+            self._segment_bytes[name] = offset
+            return {path: ("".join(records), False), self._offsets_path(name): ("".join(index_lines), False)}
+        if not lines:
+            return {}
+        return {
+            path: ("".join(record for record, _ in lines), True),
+            self._offsets_path(name): ("".join(index_line for _, index_line in lines), True),
+        }
+
+    def _drop_orphan_segments(self) -> None:
+        # удаляем только сегменты, которые очистка архива явно перечислила в манифесте (dropped):
+        # файл без записи в манифесте может оказаться единственной копией архива
+        manifest = self._history_manifest()
+        dropped = manifest.get("dropped") or []
+        for name in dropped:
+            self._segment_path(name).unlink(missing_ok=True)
+            self._offsets_path(name).unlink(missing_ok=True)
+        if dropped or self._manifest_rebuilt:
+            manifest["dropped"] = []
+            self._write_file(self.manifest_path, manifest)
+            self._manifest_rebuilt = False
 
     def _read_reviews(self) -> List[Dict]:
+        return self._load(self.reviews_log)
+
+    def _append_log(self, path: Path, item: Dict) -> None:
+        """Дописывает запись в журнал: в памяти — в конец списка, на диск — одной строкой при коммите."""
+        data = self._load(path)
+        if path not in self._cache:
+            self._remember(path, data)
+        data.append(item)
+        self._log_lines.setdefault(path, []).append(json.dumps(item, ensure_ascii=False) + "\n")
+        self._durable(path, lambda: self._render_log(path))
+
+    def _render_log(self, path: Path) -> FileWrites:
+        lines = self._log_lines.pop(path, [])
+        return {path: ("".join(lines), True)} if lines else {}
+
+    def _schema_version(self) -> int:
         try:
-            with open(self.reviews_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            data = []
-        dirty = False
-        for idx, item in enumerate(data, start=1):
-            if "review_id" not in item:
-                item["review_id"] = idx
-                dirty = True
-            if "user_username" not in item:
-                item["user_username"] = None
-                dirty = True
-            if "user_fullname" not in item:
-                item["user_fullname"] = None
-                dirty = True
-            if "name" not in item:
-                item["name"] = None
-                dirty = True
-            if "birth_date" not in item:
-                item["birth_date"] = None
-                dirty = True
-            if "order_created_at" not in item:
-                item["order_created_at"] = None
-                dirty = True
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                return int(json.load(f).get("schema_version", 0))
+        except (FileNotFoundError, json.JSONDecodeError, ValueError):
+            return 0
+
+    @locked
+    def migrate(self) -> None:
+        """Однократно доводит файлы до SCHEMA_VERSION; данные и отметка версии сохраняются одним коммитом."""
+        version = start = self._schema_version()
+        while version < SCHEMA_VERSION:
+            version += 1
+            getattr(self, f"_migrate_v{version}")()
+            log.info("Storage %s migrated to schema v%s", self.path, version)
+        if version != start:
+            stamp = json.dumps({"schema_version": version})
+            self._durable(self.meta_path, lambda: {self.meta_path: (stamp, False)})
+
+    def _migrate_v1(self) -> None:
+        # поля, которые раньше дописывались при каждом чтении
+        queue = self._read()
+        for item in queue:
+            for key, value in QUEUE_DEFAULTS.items():
+                item.setdefault(key, value)
             if "order_id" not in item:
-                item["order_id"] = None
-                dirty = True
-        if dirty:
-            self._write_reviews(data)
-        return data
+                item["order_id"] = self._sequence.next()
+        sort_queue(queue)
+        self._write(queue)
+        if self.history_path.exists():
+            history = self._load(self.history_path)
+            for idx, item in enumerate(history, start=1):
+                for key, value in HISTORY_DEFAULTS.items():
+                    item.setdefault(key, value)
+                item.setdefault("archive_id", idx)
+                if "order_id" not in item:
+                    item["order_id"] = self._sequence.next()
+            self._write_file(self.history_path, history)
+        if self.reviews_path.exists():
+            reviews = self._load(self.reviews_path)
+            for idx, item in enumerate(reviews, start=1):
+                for key, value in REVIEW_DEFAULTS.items():
+                    item.setdefault(key, value)
+                item.setdefault("review_id", idx)
+            self._write_file(self.reviews_path, reviews)
 
-    def _write_reviews(self, data: List[Dict]) -> None:
-        with open(self.reviews_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    def _migrate_v2(self) -> None:
+        # позиция в очереди теперь вычисляется из ранга
+        queue = self._read()
+        for item in queue:
+            item.pop("position", None)
+        self._write(queue)
 
+    def _migrate_v3(self) -> None:
+        # архив переезжает из history.json в помесячные сегменты; сам history.json остаётся как есть
+        self._append_history(self._load(self.history_path))
+
+    def _migrate_v4(self) -> None:
+        # у каждого сегмента появляется индекс смещений; переписываем сегменты вместе с ним
+        for segment in self._history_manifest()["segments"]:
+            path = self._segment_path(segment["name"])
+            self._load(path)
+            self._rewrite_history(path)
+
+    def _migrate_v5(self) -> None:
+        # отзывы переезжают в журнал reviews.ndjson; reviews.json остаётся как есть
+        for item in self._load(self.reviews_path):
+            self._append_log(self.reviews_log, item)
+
+    def _migrate_v6(self) -> None:
+        # накопительные итоги архива для статистики
+        self._write_file(self.stats_path, self._build_history_stats().data)
+
+    def _migrate_v7(self) -> None:
+        # в индексе смещений появились дата создания и услуга (лента заказов) — переписываем индексы
+        self._migrate_v4()
+
+    def _migrate_v8(self) -> None:
+        # в индекс смещений добавлен user_id («Мои заявки» по архиву)
+        self._migrate_v4()
+
+    def _migrate_v9(self) -> None:
+        # тексты раскладов переезжают из записей в blobs/, в записи остаётся ссылка
+        def move(items: List[Dict]) -> bool:
+            moved = False
+            for item in items:
+                if isinstance(item.get("result_payload"), dict):
+                    item["result_blob"] = self._put_blob(item["result_payload"])
+                    item["result_payload"] = None
+                    moved = True
+            return moved
+
+        queue = self._read()
+        if move(queue):
+            self._write(queue)
+        for segment in self._history_manifest()["segments"]:
+            path = self._segment_path(segment["name"])
+            if move(self._load(path)):
+                self._rewrite_history(path)
+
+    @locked
     def add_request(
         self,
         user_id: int,
@@ -202,12 +1199,10 @@ class QueueStorage:
         payment_status: str = "pending",
     ) -> int:
         data = self._read()
-        max_order_id = max(
-            max((item.get("order_id", 0) or 0) for item in data) if data else 0,
-            self._max_order_id_from_path(self.history_path),
-        )
+        index = self._queue_index()
+        lanes = self._queue_lanes()
         new_item = {
-            "order_id": max_order_id + 1,
+            "order_id": self._sequence.next(),
             "user_id": user_id,
             "service_id": service_id,
             "birth_date": birth_date,
@@ -222,149 +1217,328 @@ class QueueStorage:
             "session_status": "pending",
             "result_sent": False,
             "result_payload": None,
+            "result_blob": None,
             "review_skipped_at": None,
             "created_at": now_ekb().isoformat(),
         }
         data.append(new_item)
-        data.sort(key=lambda x: (not x.get("is_urgent", False), x.get("created_at", "")))
-        for idx, item in enumerate(data, start=1):
-            item["position"] = idx
-        self._write(data)
-        for item in data:
-            if item is new_item:
-                return item["position"]
-        return len(data)
+        index.add(new_item)
+        lanes.insert(new_item)
+        if self._search is not None:
+            self._search.add(("live", new_item["order_id"]), new_item)
+        self._commit_queue(data, {"op": "add", "item": new_item})
+        return lanes.position(new_item)
 
     def list_user_requests(self, user_id: int) -> List[str]:
-        entries = self._read()
-        lines: List[str] = []
-        for item in entries:
-            if item.get("user_id") != user_id:
-                continue
-            service = get_service_by_id(item.get("service_id", "")) or {"title": item.get("service_id", "")}
-            pay_status = item.get("payment_status")
-            pay_text = "оплачено" if pay_status == "paid" else "на проверке"
-            created = item.get("created_at", "")
-            created_date = created.split("T")[0] if "T" in created else created
-            lines.append(f"{service['title']}, {created_date}, {pay_text}")
-        return lines
+        lanes = self._queue_lanes()
+        items = sorted(self._queue_index().get_all("user_id", user_id), key=lanes.position)
+        return [format_user_request(item) for item in items]
+
+    def list_user_orders(self, user_id: int) -> List[Dict]:
+        """Заказы пользователя: сначала текущие (с позицией, по очереди), затем архивные, новые первыми."""
+        with self._lock:
+            lanes = self._queue_lanes()
+            live = [(lanes.position(item), item) for item in self._queue_index().get_all("user_id", user_id)]
+            by_archive = self._history_offsets()[0]
+            archived = [self._read_archived(by_archive[archive_id]) for archive_id in reversed(self._archive_users.get(user_id, []))]
+            return [self._with_position(item, position) for position, item in sorted(live, key=lambda x: x[0])] + archived
+
+    def find_orders(self, query: str, limit: int = 20) -> Dict:
+        """Поиск по имени, контактам, дате рождения и тексту запроса: сначала очередь, затем архив (новые первыми)."""
+        with self._lock:
+            keys = self._search_index().search(query)
+            lanes = self._queue_lanes()
+            live = sorted((lanes.position(lanes.items[ref]), ref) for kind, ref in keys if kind == "live")
+            archived = sorted((ref for kind, ref in keys if kind == "arch"), reverse=True)
+            items = [self._with_position(lanes.items[order_id], position) for position, order_id in live[:limit]]
+            items += [self.get_history_by_id(archive_id) for archive_id in archived[: limit - len(items)]]
+            return {"items": items, "total": len(keys)}
 
     def list_all(self) -> List[Dict]:
-        return self._read()
+        return [self._with_position(item, pos) for pos, item in enumerate(self._queue_lanes().ordered(), start=1)]
 
     def list_by_payment_status(self, statuses: List[str]) -> List[Dict]:
-        return [item for item in self._read() if item.get("payment_status") in statuses]
+        return [item for item in self.list_all() if item.get("payment_status") in statuses]
 
+    @locked
     def update_payment_status(self, position: int, status: str) -> bool:
-        data = self._read()
-        for item in data:
-            if item.get("position") == position:
-                item["payment_status"] = status
-                self._write(data)
-                return True
-        return False
+        lanes = self._queue_lanes()
+        item = lanes.at(position)
+        if not item:
+            return False
+        lanes.update(item, {"payment_status": status})
+        self._commit_queue(self._read(), {"op": "set", "order_id": item["order_id"], "fields": {"payment_status": status}})
+        return True
 
+    @locked
     def update_session_status(self, position: int, status: str) -> bool:
-        data = self._read()
-        for item in data:
-            if item.get("position") == position:
-                item["session_status"] = status
-                self._write(data)
-                return True
-        return False
+        lanes = self._queue_lanes()
+        item = lanes.at(position)
+        if not item:
+            return False
+        lanes.update(item, {"session_status": status})
+        self._commit_queue(self._read(), {"op": "set", "order_id": item["order_id"], "fields": {"session_status": status}})
+        return True
+
+    def queue_page(
+        self,
+        service_id: Optional[str] = None,
+        payment_status: Optional[str] = None,
+        session_done: Optional[bool] = None,
+        after: Optional[int] = None,
+        before: Optional[int] = None,
+        limit: int = 5,
+    ) -> Dict:
+        """
+        Страница очереди в порядке позиций: after/before — order_id крайней записи соседней страницы.
+        Возвращает {"items", "total", "next", "prev"}; total берётся из счётчиков, а не подсчётом.
+        """
+        with self._lock:
+            lanes = self._queue_lanes()
+
+            def matches(item: Dict) -> bool:
+                return (
+                    (service_id is None or item.get("service_id") == service_id)
+                    and (payment_status is None or item.get("payment_status") == payment_status)
+                    and (session_done is None or (item.get("session_status") == "done") == session_done)
+                )
+
+            def walk(positions: Iterable[int]) -> Iterator[Dict]:
+                for position in positions:
+                    item = lanes.at(position)
+                    if matches(item):
+                        yield self._with_position(item, position)
+
+            cursor = before if before is not None else after
+            # курсор мог уйти в архив — ключ сортировки (срочность, дата, номер) у записи тот же
+            anchor = None if cursor is None else lanes.items.get(cursor) or self.get_history_by_order_id(cursor)
+            if anchor is None:
+                page = keyset_page(walk(range(1, len(lanes) + 1)), iter(()), limit, "order_id")
+            else:
+                rank = lanes.position(anchor)
+                if before is not None:
+                    ahead, behind = range(rank - 1, 0, -1), range(rank, len(lanes) + 1)
+                    page = keyset_page(walk(ahead), walk(behind), limit, "order_id", backward=True)
+                else:
+                    first_after = rank + 1 if cursor in lanes.items else rank
+                    ahead, behind = range(first_after, len(lanes) + 1), range(first_after - 1, 0, -1)
+                    page = keyset_page(walk(ahead), walk(behind), limit, "order_id")
+                if not page["items"]:
+                    page = keyset_page(walk(range(1, len(lanes) + 1)), iter(()), limit, "order_id")
+            page["total"] = lanes.count(service_id, payment_status, session_done)
+            return page
 
     def get_by_position(self, position: int) -> Optional[Dict]:
-        for item in self._read():
-            if item.get("position") == position:
-                return item
-        return None
+        return self._with_position(self._queue_lanes().at(position), position)
 
     def get_by_order_id(self, order_id: int) -> Optional[Dict]:
-        for item in self._read():
-            if item.get("order_id") == order_id:
-                return item
-        return None
+        return self._with_position(self._queue_index().get("order_id", order_id))
 
+    @locked
     def delete_and_archive(self, position: int) -> bool:
-        data = self._read()
-        target = None
-        rest: List[Dict] = []
-        for item in data:
-            if item.get("position") == position:
-                target = item
-            else:
-                rest.append(item)
+        target = self._queue_lanes().at(position)
         if not target:
             return False
-        history = self._read_history()
-        target["archived_at"] = now_ekb().isoformat()
-        target["archive_id"] = len(history) + 1
-        history.append(target)
-        self._write_history(history)
-        for idx, item in enumerate(rest, start=1):
-            item["position"] = idx
-        self._write(rest)
-        return True
+        return self.archive_orders([target["order_id"]]) > 0
+
+    @locked
+    def archive_orders(self, order_ids: Iterable[int]) -> int:
+        """Переносит заказы из очереди в историю; обе стороны и вся пачка сохраняются одним коммитом."""
+        lanes = self._queue_lanes()
+        data = self._read()
+        index = self._queue_index()
+        archive_id = self._history_total()
+        archived_at = now_ekb().isoformat()
+        archived: List[Dict] = []
+        for order_id in order_ids:
+            target = index.get("order_id", order_id)
+            if target is None:
+                continue
+            # позиция на момент архивации — как если бы заказы архивировали по одному
+            target["position"] = lanes.position(target)
+            archive_id += 1
+            target["archived_at"] = archived_at
+            target["archive_id"] = archive_id
+            index.remove(target)
+            lanes.remove(target)
+            if self._search is not None:
+                self._search.remove(("live", order_id))
+            archived.append(target)
+        if not archived:
+            return 0
+        self._append_history(archived)
+        removed = [item["order_id"] for item in archived]
+        removed_set = set(removed)
+        data[:] = [item for item in data if item["order_id"] not in removed_set]
+        self._commit_queue(data, {"op": "archive", "order_ids": removed})
+        return len(archived)
+
+    @locked
+    def archive_done(self) -> int:
+        """Архивирует все заказы с проведённым сеансом."""
+        order_ids = [item["order_id"] for item in self._read() if item.get("session_status") == "done"]
+        return self.archive_orders(order_ids)
 
     def list_history(self, limit: int = 20) -> List[Dict]:
-        history = self._read_history()
-        return history[-limit:][::-1]
+        return [dict(item) for item in self._history_tail(limit)]
+
+    def _history_walk(self, anchor: Optional[int], newer: bool, include: bool = False) -> Iterator[Dict]:
+        """Записи архива от anchor (archive_id) к более новым или старым; без anchor — с самой новой."""
+        names = [segment["name"] for segment in self._history_manifest()["segments"]]
+        if anchor is None:
+            index, line = len(names) - 1, None
+        else:
+            entry = self._history_offsets()[0].get(anchor)
+            if entry is None:
+                return
+            index, line = names.index(entry[0]), entry[1]
+            if include:
+                line += -1 if newer else 1
+        while 0 <= index < len(names):
+            part = self._load(self._segment_path(names[index]))
+            if newer:
+                yield from part[0 if line is None else line + 1 :]
+            else:
+                yield from reversed(part[: len(part) if line is None else line])
+            index += 1 if newer else -1
+            line = None
+
+    def history_page(
+        self,
+        service_id: Optional[str] = None,
+        after: Optional[int] = None,
+        before: Optional[int] = None,
+        limit: int = 5,
+    ) -> Dict:
+        """Страница архива, новые первыми; after/before — archive_id крайней записи соседней страницы."""
+        with self._lock:
+
+            def walk(anchor: Optional[int], newer: bool, include: bool = False) -> Iterator[Dict]:
+                for item in self._history_walk(anchor, newer, include):
+                    if service_id is None or item.get("service_id") == service_id:
+                        yield dict(item)
+
+            if before is not None:
+                page = keyset_page(walk(before, True), walk(before, False, True), limit, "archive_id", backward=True)
+            elif after is not None:
+                page = keyset_page(walk(after, False), walk(after, True, True), limit, "archive_id")
+            else:
+                page = {"items": []}
+            if not page["items"]:
+                page = keyset_page(walk(None, False), iter(()), limit, "archive_id")
+            page["total"] = self._history_total() if service_id is None else self.history_stats(0, service_id)[0]
+            return page
+
+    def _timeline_keys(self, service_id: Optional[str] = None) -> Iterator[Tuple]:
+        """
+        Ключи заказов очереди и архива, новые первыми: ленивое слияние уже отсортированных ключей
+        (полосы очереди и лента архива). Фильтр по услуге работает по ключам, без чтения архива.
+        """
+        lanes = self._queue_lanes()
+        live = heapq.merge(reversed(lanes.urgent), reversed(lanes.normal), reverse=True)
+        merged = heapq.merge(
+            ((created_at, "live", order_id) for created_at, order_id in live),
+            ((created_at, "arch", archive_id, service) for created_at, archive_id, service in reversed(self._timeline)),
+            key=lambda key: key[0],
+            reverse=True,
+        )
+        for key in merged:
+            if key[1] == "live":
+                if service_id is None or lanes.items[key[2]].get("service_id") == service_id:
+                    yield key
+            elif service_id is None or key[3] == service_id:
+                yield key
+
+    def timeline_page(self, service_id: Optional[str] = None, offset: int = 0, limit: int = 5) -> Dict:
+        """Страница ленты заказов с отметкой об отзыве: {"items": [{"kind", "item", "review"}], "total"}."""
+        with self._lock:
+            reviews = self._reviews_index()
+            lanes = self._queue_lanes()
+            by_archive = self._history_offsets()[0]
+            # пропущенные страницы — только ключи в памяти, с диска читаются записи самой страницы
+            items = []
+            for key in itertools.islice(self._timeline_keys(service_id), offset, offset + limit):
+                if key[1] == "live":
+                    item = self._with_position(lanes.items[key[2]])
+                else:
+                    item = self._read_archived(by_archive[key[2]])
+                review = _copy(reviews.get("order_id", item.get("order_id")))
+                items.append({"kind": key[1], "item": item, "review": review})
+            archived = self._history_total() if service_id is None else self.history_stats(0, service_id)[0]
+            return {"items": items, "total": lanes.count(service_id) + archived}
 
     def get_history_by_id(self, archive_id: int) -> Optional[Dict]:
-        for item in self._read_history():
-            if item.get("archive_id") == archive_id:
-                return item
-        return None
+        return self._read_archived(self._history_offsets()[0].get(archive_id))
 
     def get_history_by_order_id(self, order_id: int) -> Optional[Dict]:
-        for item in self._read_history():
-            if item.get("order_id") == order_id:
-                return item
-        return None
+        return self._read_archived(self._history_offsets()[1].get(order_id))
 
+    @locked
     def set_result_sent(self, order_id: int, payload: Dict) -> bool:
-        data = self._read()
-        for item in data:
-            if item.get("order_id") == order_id:
-                item["result_sent"] = True
-                item["result_payload"] = payload
-                self._write(data)
-                return True
-        history = self._read_history()
-        for item in history:
-            if item.get("order_id") == order_id:
-                item["result_sent"] = True
-                item["result_payload"] = payload
-                self._write_history(history)
-                return True
-        return False
+        item = self._queue_index().get("order_id", order_id)
+        found = None if item else self._history_record(order_id)
+        if not item and not found:
+            return False
+        fields = {"result_sent": True, "result_blob": self._put_blob(payload), "result_payload": None}
+        if item:
+            item.update(fields)
+            self._commit_queue(self._read(), {"op": "set", "order_id": order_id, "fields": fields})
+        else:
+            item, path = found
+            item.update(fields)
+            self._rewrite_history(path)
+        return True
+
+    def get_result_payload(self, order_id: int) -> Optional[Dict]:
+        """Отправленный расклад; сам текст читается из blobs/ только здесь, а не с каждой записью."""
+        item = self.get_by_order_id(order_id) or self.get_history_by_order_id(order_id)
+        if not item:
+            return None
+        if item.get("result_blob"):
+            return self._read_blob(item["result_blob"])
+        return item.get("result_payload")
 
+    @locked
     def set_review_skipped(self, order_id: int) -> bool:
         stamp = now_ekb().isoformat()
-        data = self._read()
-        for item in data:
-            if item.get("order_id") == order_id:
-                item["review_skipped_at"] = stamp
-                self._write(data)
-                return True
-        history = self._read_history()
-        for item in history:
-            if item.get("order_id") == order_id:
-                item["review_skipped_at"] = stamp
-                self._write_history(history)
-                return True
+        item = self._queue_index().get("order_id", order_id)
+        if item:
+            item["review_skipped_at"] = stamp
+            self._commit_queue(self._read(), {"op": "set", "order_id": order_id, "fields": {"review_skipped_at": stamp}})
+            return True
+        found = self._history_record(order_id)
+        if found:
+            item, path = found
+            item["review_skipped_at"] = stamp
+            self._rewrite_history(path)
+            return True
         return False
 
     def history_stats(self, default_price: int = 2500, service_id: str | None = None) -> tuple[int, int]:
-        history = self._read_history()
+        stats = self._history_stats_data()
         if service_id:
-            history = [item for item in history if item.get("service_id") == service_id]
-        total = len(history)
-        total_sum = sum(
-            item.get("price") if isinstance(item.get("price"), int) else default_price for item in history
-        )
-        return total, total_sum
+            return stats.get("service", service_id, default_price)
+        return stats.get("total", "", default_price)
+
+    def history_breakdown(
+        self, default_price: int = 2500, days: int = 7, months: int = 6
+    ) -> Dict[str, List[Tuple[str, int, int]]]:
+        """Итоги по услугам, последним дням и месяцам: {срез: [(ключ, заказов, сумма)]}."""
+        stats = self._history_stats_data()
+        return {
+            "service": stats.breakdown("service", default_price),
+            "day": stats.breakdown("day", default_price, days),
+            "month": stats.breakdown("month", default_price, months),
+        }
 
+    @locked
+    def rebuild_history_stats(self) -> int:
+        """Пересчитывает итоги по всему архиву (на случай расхождений); возвращает число заказов."""
+        stats = self._build_history_stats()
+        self._write_file(self.stats_path, stats.data)
+        return stats.get("total", "", 0)[0]
+
+    @locked
     def add_review(
         self,
         user_id: int,
@@ -377,8 +1551,8 @@ class QueueStorage:
         order_created_at: Optional[str],
         order_id: Optional[int],
     ) -> int:
-        reviews = self._read_reviews()
         new_item = {
+            "review_id": self._review_sequence.next(),
             "user_id": user_id,
             "service_id": service_id,
             "text": text,
@@ -390,37 +1564,86 @@ class QueueStorage:
             "order_id": order_id,
             "created_at": now_ekb().isoformat(),
         }
-        reviews.append(new_item)
-        for idx, item in enumerate(reviews, start=1):
-            item["review_id"] = idx
-        self._write_reviews(reviews)
-        return reviews[-1]["review_id"]
+        index = self._reviews_index()
+        self._append_log(self.reviews_log, new_item)
+        index.add(new_item)
+        if self._review_search is not None:
+            self._review_search.add(new_item["review_id"], text)
+        return new_item["review_id"]
 
     def list_reviews(self, service_id: str | None = None) -> List[Dict]:
-        reviews = self._read_reviews()
         if service_id:
-            reviews = [item for item in reviews if item.get("service_id") == service_id]
-        return reviews[::-1]
+            return [dict(item) for item in reversed(self._reviews_index().get_all("service_id", service_id))]
+        return [dict(item) for item in reversed(self._read_reviews())]
+
+    def search_reviews(self, query: str, service_id: str | None = None, offset: int = 0, limit: int = 5) -> Dict:
+        """Полнотекстовый поиск по отзывам (основы слов, BM25): {"items": [отзыв + score], "total"}."""
+        with self._lock:
+            reviews = self._reviews_index()
+            ranked = [
+                (score, reviews.get("review_id", review_id))
+                for score, review_id in self._review_search_index().search(query)
+            ]
+            if service_id:
+                ranked = [(score, item) for score, item in ranked if item.get("service_id") == service_id]
+            page = [dict(item, score=round(score, 3)) for score, item in ranked[offset : offset + limit]]
+            return {"items": page, "total": len(ranked)}
 
     def get_review_by_id(self, review_id: int) -> Optional[Dict]:
-        for item in self._read_reviews():
-            if item.get("review_id") == review_id:
-                return item
-        return None
+        return _copy(self._reviews_index().get("review_id", review_id))
 
     def get_review_for_order(self, order_id: Optional[int]) -> Optional[Dict]:
         if not order_id:
             return None
-        for item in self._read_reviews():
-            if item.get("order_id") == order_id:
-                return item
-        return None
+        return _copy(self._reviews_index().get("order_id", order_id))
 
+    @locked
     def clear_history(self) -> None:
-        self._write_history([])
+        # только манифест: файлы сегментов из dropped удаляются при следующем старте
+        manifest = self._history_manifest()
+        manifest["dropped"] = manifest.get("dropped", []) + [segment["name"] for segment in manifest["segments"]]
+        manifest["segments"] = []
+        self._offsets = ({}, {})
+        self._timeline = []
+        self._archive_users = {}
+        self._search = None
+        self._write_file(self.manifest_path, manifest)
+        self._write_file(self.stats_path, HistoryStats().data)
 
 
 QUEUE_PATH = Path(os.getenv("STORAGE_PATH", "data/queue.json"))
 HISTORY_PATH = Path(os.getenv("HISTORY_PATH", "data/history.json"))
 REVIEWS_PATH = Path(os.getenv("REVIEWS_PATH", "data/reviews.json"))
-storage = QueueStorage(QUEUE_PATH, HISTORY_PATH, REVIEWS_PATH)
+SQLITE_PATH = Path(os.getenv("SQLITE_PATH", "data/storage.sqlite3"))
+STORAGE_CACHE = os.getenv("STORAGE_CACHE", "1").strip() != "0"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").strip().lower()
+JOURNAL_COMPACT_BYTES = int(os.getenv("JOURNAL_COMPACT_BYTES", str(256 * 1024)))
+# окно group commit: изменения, пришедшие за это время, сохраняются одной записью (0 — писать сразу)
+GROUP_COMMIT_MS = float(os.getenv("GROUP_COMMIT_MS", "5"))
+
+
+def create_storage():
+    if STORAGE_BACKEND == "sqlite":
+        from app.storage_sqlite import SqliteQueueStorage
+
+        return SqliteQueueStorage(SQLITE_PATH, import_from=(QUEUE_PATH, HISTORY_PATH, REVIEWS_PATH))
+    if STORAGE_BACKEND == "journal":
+        from app.storage_journal import JournalQueueStorage
+
+        return JournalQueueStorage(
+            QUEUE_PATH,
+            HISTORY_PATH,
+            REVIEWS_PATH,
+            compact_bytes=JOURNAL_COMPACT_BYTES,
+            commit_window=GROUP_COMMIT_MS / 1000,
+        )
+    return QueueStorage(
+        QUEUE_PATH,
+        HISTORY_PATH,
+        REVIEWS_PATH,
+        cached=STORAGE_CACHE,
+        commit_window=GROUP_COMMIT_MS / 1000,
+    )
+
+
+storage = create_storage()
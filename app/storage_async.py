@@ -0,0 +1,158 @@
+import asyncio
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+
+class AsyncRWLock:
+    """Читатели работают параллельно, писатель — один и без читателей; ждущий писатель не голодает."""
+
+    def __init__(self) -> None:
+        self._cond: Optional[asyncio.Condition] = None
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    @asynccontextmanager
+    async def read(self):
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: not self._writer and not self._waiting_writers)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with cond:
+                self._readers -= 1
+                cond.notify_all()
+
+    @asynccontextmanager
+    async def write(self):
+        cond = self._condition()
+        async with cond:
+            self._waiting_writers += 1
+            try:
+                await cond.wait_for(lambda: not self._writer and self._readers == 0)
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            async with cond:
+                self._writer = False
+                cond.notify_all()
+
+
+def _async_method(name: str, writer: bool) -> Callable[..., Awaitable[Any]]:
+    async def call(self, *args, **kwargs):
+        return await self._run_async(getattr(self, name), writer, *args, **kwargs)
+
+    call.__name__ = call.__qualname__ = "a" + name
+    call.storage_method = name
+    return call
+
+
+def reader(name: str) -> Callable[..., Awaitable[Any]]:
+    return _async_method(name, writer=False)
+
+
+def writer(name: str) -> Callable[..., Awaitable[Any]]:
+    return _async_method(name, writer=True)
+
+
+class AsyncStorageMixin:
+    """
+    Асинхронный фасад над синхронным хранилищем: storage.a<метод>(...) выполняет <метод>
+    в отдельном пуле потоков, не блокируя event loop. Обёртки объявлены ниже явно: reader —
+    чтения, идут параллельно между собой; writer — записи, идут строго по одному.
+    """
+
+    # чтения
+    alist_user_requests = reader("list_user_requests")
+    alist_user_orders = reader("list_user_orders")
+    alist_all = reader("list_all")
+    afind_orders = reader("find_orders")
+    alist_by_payment_status = reader("list_by_payment_status")
+    aget_by_position = reader("get_by_position")
+    aget_by_order_id = reader("get_by_order_id")
+    aqueue_page = reader("queue_page")
+    alist_history = reader("list_history")
+    ahistory_page = reader("history_page")
+    atimeline_page = reader("timeline_page")
+    aget_history_by_id = reader("get_history_by_id")
+    aget_history_by_order_id = reader("get_history_by_order_id")
+    aget_result_payload = reader("get_result_payload")
+    ahistory_stats = reader("history_stats")
+    ahistory_breakdown = reader("history_breakdown")
+    alist_reviews = reader("list_reviews")
+    asearch_reviews = reader("search_reviews")
+    aget_review_by_id = reader("get_review_by_id")
+    aget_review_for_order = reader("get_review_for_order")
+
+    # записи
+    aadd_request = writer("add_request")
+    aupdate_payment_status = writer("update_payment_status")
+    aupdate_session_status = writer("update_session_status")
+    adelete_and_archive = writer("delete_and_archive")
+    aarchive_orders = writer("archive_orders")
+    aarchive_done = writer("archive_done")
+    aset_result_sent = writer("set_result_sent")
+    aset_review_skipped = writer("set_review_skipped")
+    aadd_review = writer("add_review")
+    aclear_history = writer("clear_history")
+    arebuild_history_stats = writer("rebuild_history_stats")
+
+    EXECUTOR_WORKERS = 4
+
+    _executor: Optional[ThreadPoolExecutor] = None
+    _rw_lock: Optional[AsyncRWLock] = None
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        # опечатка в объявлении обёртки видна сразу при импорте, а не при первом вызове из хендлера
+        super().__init_subclass__(**kwargs)
+        for attr in vars(AsyncStorageMixin).values():
+            name = getattr(attr, "storage_method", None)
+            if name is not None and not callable(getattr(cls, name, None)):
+                raise TypeError(f"{cls.__name__} has no method {name!r} for async wrapper a{name}")
+
+    # изменение упало посередине, и состояние в памяти нужно перечитать с диска (см. _recover)
+    _stale = False
+
+    def _settle(self) -> None:
+        """Хук для бэкендов с отложенной записью: дождаться, пока изменения вызова лягут на диск."""
+
+    def _pending_state(self) -> Any:
+        """Хук для бэкендов с отложенной записью: снимок ещё не сброшенных изменений перед вызовом."""
+
+    def _abandon(self, state: Any) -> None:
+        """Хук для бэкендов с отложенной записью: изменение упало — отбросить всё, что оно успело накопить."""
+
+    def _recover(self) -> None:
+        """Хук для бэкендов с отложенной записью: привести память в соответствие с диском после _abandon."""
+
+    def _call_for_async(self, method: Callable[..., Any], *args, **kwargs) -> Tuple[Any, List[Future]]:
+        """Хук для бэкендов с отложенной записью: результат и ещё не сброшенные на диск записи."""
+        return method(*args, **kwargs), []
+
+    async def _run_async(self, method: Callable[..., Any], writer: bool, *args, **kwargs) -> Any:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.EXECUTOR_WORKERS, thread_name_prefix="storage")
+        if self._rw_lock is None:
+            self._rw_lock = AsyncRWLock()
+        lock = self._rw_lock.write() if writer else self._rw_lock.read()
+        loop = asyncio.get_running_loop()
+        async with lock:
+            result, pending = await loop.run_in_executor(
+                self._executor, functools.partial(self._call_for_async, method, *args, **kwargs)
+            )
+        # на диск ждём уже без блокировки, чтобы следующие записи попали в тот же group commit
+        for future in pending:
+            await asyncio.wrap_future(future)
+        return result
@@ -0,0 +1,139 @@
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.logger import get_logger
+from app.storage import SCHEMA_VERSION, FileWrites, QueueStorage
+
+
+log = get_logger(__name__)
+
+
+class JournalQueueStorage(QueueStorage):
+    """
+    Очередь = снапшот (queue.json) + журнал мутаций (queue.journal, по строке JSON на изменение).
+    При старте снапшот загружается и журнал проигрывается поверх; когда журнал вырастает больше
+    compact_bytes, при очередном коммите (в потоке group commit) вместе пишутся новый снапшот
+    и пустой журнал. Рассчитано на то, что файлы очереди принадлежат одному процессу.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        history_path: Path,
+        reviews_path: Path,
+        compact_bytes: int = 256 * 1024,
+        commit_window: float = 0.005,
+    ) -> None:
+        self.journal_path = path.with_suffix(".journal")
+        self.compact_bytes = compact_bytes
+        self._data: Optional[List[Dict]] = None
+        # строки, которые ещё не дописаны в журнал: уходят на диск в ближайшем коммите
+        self._unwritten: List[str] = []
+        self._journal_size = 0
+        super().__init__(path, history_path, reviews_path, cached=True, commit_window=commit_window)
+        with self._lock:
+            if self.journal_path.exists():
+                self._journal_size = self.journal_path.stat().st_size
+
+    def migrate(self) -> None:
+        # миграции должны видеть и строки журнала, записанные по старой схеме: проигрываем его до них
+        with self._lock:
+            self._data = self._replay()
+            if self._schema_version() < SCHEMA_VERSION and self.journal_path.exists():
+                # журнал сворачивается в снапшот одним коммитом, иначе при следующем старте
+                # его старые строки снова легли бы поверх уже мигрированных записей
+                self._remember(self.path, self._data)
+                self._commit(
+                    {
+                        self.path: lambda: self._render_file(self.path),
+                        self.journal_path: lambda: {self.journal_path: ("", False)},
+                    }
+                )
+        super().migrate()
+
+    def _replay(self) -> List[Dict]:
+        data = super()._read()
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return data
+        applied = 0
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # недописанная последняя строка после падения
+                log.warning("Journal %s: skipped broken record", self.journal_path)
+                continue
+            self._apply(data, record)
+            applied += 1
+        log.info("Journal %s: replayed %s records", self.journal_path, applied)
+        return data
+
+    @staticmethod
+    def _apply(data: List[Dict], record: Dict) -> None:
+        # Операции идемпотентны: повторное проигрывание поверх свежего снапшота даёт то же состояние.
+        op = record.get("op")
+        if op == "add":
+            item = record["item"]
+            if not any(x.get("order_id") == item.get("order_id") for x in data):
+                data.append(dict(item))
+        elif op == "set":
+            for item in data:
+                if item.get("order_id") == record.get("order_id"):
+                    item.update(record.get("fields") or {})
+                    break
+        elif op == "remove":
+            data[:] = [x for x in data if x.get("order_id") != record.get("order_id")]
+        elif op == "archive":
+            # история сохраняется тем же коммитом, что и эта строка, журнал её не трогает
+            removed = set(record.get("order_ids") or [])
+            data[:] = [x for x in data if x.get("order_id") not in removed]
+
+    def _pending_state(self) -> Tuple:
+        return super()._pending_state(), list(self._unwritten), self._journal_size
+
+    def _requeue(self, state: Tuple, paths: Iterable[Path]) -> None:
+        base, unwritten, journal_size = state
+        super()._requeue(base, paths)
+        if self.journal_path in paths:
+            self._unwritten = unwritten + self._unwritten
+            self._journal_size = journal_size
+
+    def _abandon(self, state: Tuple) -> None:
+        base, unwritten, _ = state
+        super()._abandon(base)
+        self._unwritten = unwritten
+
+    def _invalidate(self) -> None:
+        super()._invalidate()
+        self._unwritten = []
+        self._data = self._replay()
+        self._journal_size = self.journal_path.stat().st_size if self.journal_path.exists() else 0
+
+    def _read(self) -> List[Dict]:
+        if self._data is None:
+            return super()._read()
+        return self._data
+
+    def _commit_queue(self, data: List[Dict], record: Dict) -> None:
+        self._data = data
+        self._unwritten.append(json.dumps(record, ensure_ascii=False) + "\n")
+        self._durable(self.journal_path, self._render_journal)
+
+    def _render_journal(self) -> FileWrites:
+        lines, self._unwritten = self._unwritten, []
+        if not lines:
+            return {}
+        text = "".join(lines)
+        size = self._journal_size + len(text.encode("utf-8"))
+        if size < self.compact_bytes:
+            self._journal_size = size
+            return {self.journal_path: (text, True)}
+        # снапшот уже включает все строки журнала, поэтому журнал просто обнуляется тем же коммитом
+        log.info("Journal %s compacted (%s bytes)", self.journal_path, size)
+        self._journal_size = 0
+        snapshot = json.dumps(self._data, ensure_ascii=False, indent=2)
+        return {self.path: (snapshot, False), self.journal_path: ("", False)}
@@ -0,0 +1,889 @@
+import hashlib
+import json
+import shutil
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.logger import get_logger
+from app.search import TextIndex, item_tokens, matches, query_tokens, text_terms
+from app.services.booking import now_ekb
+from app.storage import HistoryStats, QueueStorage, format_user_request, keyset_page, locked
+from app.storage_async import AsyncStorageMixin
+
+
+log = get_logger(__name__)
+
+ORDER_COLUMNS = (
+    "order_id",
+    "user_id",
+    "service_id",
+    "birth_date",
+    "name",
+    "problem",
+    "user_username",
+    "user_fullname",
+    "is_urgent",
+    "price",
+    "phone",
+    "payment_status",
+    "session_status",
+    "result_sent",
+    "result_payload",
+    "result_blob",
+    "review_skipped_at",
+    "created_at",
+)
+HISTORY_COLUMNS = ("archive_id",) + ORDER_COLUMNS + ("position", "archived_at")
+REVIEW_COLUMNS = (
+    "review_id",
+    "user_id",
+    "service_id",
+    "text",
+    "user_username",
+    "user_fullname",
+    "name",
+    "birth_date",
+    "order_created_at",
+    "order_id",
+    "created_at",
+)
+QUEUE_ORDER = "is_urgent DESC, created_at, order_id"
+# позиция в очереди не хранится, а считается рангом
+RANKED_QUEUE = f"(SELECT *, ROW_NUMBER() OVER (ORDER BY {QUEUE_ORDER}) AS position FROM queue)"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    order_id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    service_id TEXT,
+    birth_date TEXT,
+    name TEXT,
+    problem TEXT,
+    user_username TEXT,
+    user_fullname TEXT,
+    is_urgent INTEGER NOT NULL DEFAULT 0,
+    price INTEGER,
+    phone TEXT,
+    payment_status TEXT NOT NULL DEFAULT 'pending',
+    session_status TEXT NOT NULL DEFAULT 'pending',
+    result_sent INTEGER NOT NULL DEFAULT 0,
+    result_payload TEXT,
+    result_blob TEXT,
+    review_skipped_at TEXT,
+    created_at TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_queue_rank ON queue (is_urgent DESC, created_at);
+CREATE INDEX IF NOT EXISTS idx_queue_user ON queue (user_id);
+CREATE INDEX IF NOT EXISTS idx_queue_service ON queue (service_id);
+CREATE INDEX IF NOT EXISTS idx_queue_payment ON queue (payment_status);
+CREATE INDEX IF NOT EXISTS idx_queue_created ON queue (created_at);
+
+CREATE TABLE IF NOT EXISTS history (
+    archive_id INTEGER PRIMARY KEY,
+    order_id INTEGER,
+    user_id INTEGER,
+    service_id TEXT,
+    birth_date TEXT,
+    name TEXT,
+    problem TEXT,
+    user_username TEXT,
+    user_fullname TEXT,
+    is_urgent INTEGER NOT NULL DEFAULT 0,
+    price INTEGER,
+    phone TEXT,
+    payment_status TEXT,
+    session_status TEXT,
+    result_sent INTEGER NOT NULL DEFAULT 0,
+    result_payload TEXT,
+    result_blob TEXT,
+    review_skipped_at TEXT,
+    created_at TEXT,
+    position INTEGER,
+    archived_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_history_order ON history (order_id);
+CREATE INDEX IF NOT EXISTS idx_history_user ON history (user_id);
+CREATE INDEX IF NOT EXISTS idx_history_service ON history (service_id);
+CREATE INDEX IF NOT EXISTS idx_history_payment ON history (payment_status);
+CREATE INDEX IF NOT EXISTS idx_history_created ON history (created_at);
+
+CREATE TABLE IF NOT EXISTS reviews (
+    review_id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    service_id TEXT,
+    text TEXT,
+    user_username TEXT,
+    user_fullname TEXT,
+    name TEXT,
+    birth_date TEXT,
+    order_created_at TEXT,
+    order_id INTEGER,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_reviews_order ON reviews (order_id);
+CREATE INDEX IF NOT EXISTS idx_reviews_user ON reviews (user_id);
+CREATE INDEX IF NOT EXISTS idx_reviews_service ON reviews (service_id);
+CREATE INDEX IF NOT EXISTS idx_reviews_created ON reviews (created_at);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+-- тексты раскладов по sha256; в заказе — только ссылка result_blob
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    body TEXT NOT NULL
+);
+
+-- накопительные итоги архива (см. HistoryStats): scope = total | service | day | month
+CREATE TABLE IF NOT EXISTS history_stats (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    orders INTEGER NOT NULL DEFAULT 0,
+    priced_sum INTEGER NOT NULL DEFAULT 0,
+    unpriced INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (scope, key)
+);
+
+-- сколько заказов в очереди на каждое сочетание фильтров списка; ведётся триггерами
+CREATE TABLE IF NOT EXISTS queue_counts (
+    service_id TEXT NOT NULL,
+    payment_status TEXT NOT NULL,
+    session_status TEXT NOT NULL,
+    n INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (service_id, payment_status, session_status)
+);
+CREATE TRIGGER IF NOT EXISTS queue_counts_insert AFTER INSERT ON queue BEGIN
+    INSERT INTO queue_counts VALUES (COALESCE(NEW.service_id, ''), NEW.payment_status, NEW.session_status, 1)
+    ON CONFLICT (service_id, payment_status, session_status) DO UPDATE SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS queue_counts_delete AFTER DELETE ON queue BEGIN
+    UPDATE queue_counts SET n = n - 1
+    WHERE service_id = COALESCE(OLD.service_id, '') AND payment_status = OLD.payment_status
+        AND session_status = OLD.session_status;
+END;
+CREATE TRIGGER IF NOT EXISTS queue_counts_update
+AFTER UPDATE OF service_id, payment_status, session_status ON queue BEGIN
+    UPDATE queue_counts SET n = n - 1
+    WHERE service_id = COALESCE(OLD.service_id, '') AND payment_status = OLD.payment_status
+        AND session_status = OLD.session_status;
+    INSERT INTO queue_counts VALUES (COALESCE(NEW.service_id, ''), NEW.payment_status, NEW.session_status, 1)
+    ON CONFLICT (service_id, payment_status, session_status) DO UPDATE SET n = n + 1;
+END;
+"""
+
+# токены нормализуются в Python (app.search), FTS5 только хранит их и ищет по префиксу
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS order_search USING fts5(tokens, kind UNINDEXED, ref UNINDEXED);
+-- основы слов отзывов (app.search.text_terms); ранжирование — встроенный bm25()
+CREATE VIRTUAL TABLE IF NOT EXISTS review_search USING fts5(terms, review_id UNINDEXED);
+"""
+
+
+def _to_db(item: Dict, columns: Tuple[str, ...]) -> Tuple:
+    values = []
+    for column in columns:
+        value = item.get(column)
+        if column == "result_payload" and value is not None:
+            value = json.dumps(value, ensure_ascii=False)
+        elif column in ("is_urgent", "result_sent"):
+            value = 1 if value else 0
+        values.append(value)
+    return tuple(values)
+
+
+def _from_db(row: sqlite3.Row) -> Dict:
+    item = dict(row)
+    if "is_urgent" in item:
+        item["is_urgent"] = bool(item["is_urgent"])
+    if "result_sent" in item:
+        item["result_sent"] = bool(item["result_sent"])
+    if item.get("result_payload"):
+        item["result_payload"] = json.loads(item["result_payload"])
+    return item
+
+
+def _copy_legacy(path: Path, target_dir: Path, extra: Tuple[str, ...] = ()) -> Path:
+    """Копирует файл JSON-хранилища вместе со спутниками (queue.journal, queue.seq, history/, ...) в target_dir."""
+    target_dir.mkdir(parents=True)
+    if path.parent.is_dir():
+        for source in path.parent.iterdir():
+            if source.name.startswith(path.stem + ".") or source.name in (path.stem,) + extra:
+                if source.is_dir():
+                    shutil.copytree(source, target_dir / source.name)
+                else:
+                    shutil.copy2(source, target_dir / source.name)
+    return target_dir / path.name
+
+
+class SqliteQueueStorage(AsyncStorageMixin):
+    """
+    Тот же интерфейс, что у QueueStorage, но очередь, архив и отзывы лежат в SQLite (WAL).
+    Запись идёт через одно соединение под блокировкой, чтение — через соединение своего потока.
+    """
+
+    def __init__(self, db_path: Path, import_from: Optional[Tuple[Path, Path, Path]] = None) -> None:
+        self.db_path = db_path
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        for table in ("queue", "history"):
+            # базы, созданные до появления result_blob
+            columns = {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if "result_blob" not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN result_blob TEXT")
+        try:
+            self._conn.executescript(SEARCH_SCHEMA)
+            self._fts = True
+        except sqlite3.OperationalError:
+            log.warning("SQLite without FTS5: /admin_find falls back to a full scan")
+            self._fts = False
+        if import_from:
+            self.import_json(*import_from)
+        if not self._meta("history_stats_built"):
+            self.rebuild_history_stats()
+        if not self._meta("result_blobs_moved"):
+            self._move_payloads_to_blobs()
+        if not self._meta("queue_counts_built"):
+            self._rebuild_queue_counts()
+        if self._fts and not self._meta("search_built"):
+            self._rebuild_search()
+        if self._fts and not self._meta("review_search_built"):
+            self._rebuild_review_search()
+
+    def _db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _tx(self):
+        if self._conn.in_transaction:
+            yield
+            return
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @locked
+    def import_json(self, queue_path: Path, history_path: Path, reviews_path: Path) -> bool:
+        """Однократный перенос данных из JSON-файлов; повторно не выполняется."""
+        if self._meta("json_imported"):
+            return False
+        if not any(path.exists() for path in (queue_path, history_path, reviews_path)):
+            with self._tx():
+                self._set_meta("json_imported", now_ekb().isoformat())
+            return False
+        # JSON-хранилище при открытии доводит файлы до текущей схемы, поэтому читаем копию: исходники не трогаем
+        with tempfile.TemporaryDirectory(prefix="import-", dir=self.db_path.parent) as tmp:
+            queue_path, history_path, reviews_path = (
+                _copy_legacy(path, Path(tmp) / str(n), extra=("blobs",) if n == 0 else ())
+                for n, path in enumerate((queue_path, history_path, reviews_path))
+            )
+            if queue_path.with_suffix(".journal").exists():
+                from app.storage_journal import JournalQueueStorage
+
+                legacy = JournalQueueStorage(queue_path, history_path, reviews_path, commit_window=0)
+            else:
+                legacy = QueueStorage(queue_path, history_path, reviews_path, cached=False, commit_window=0)
+            queue, history, reviews = legacy._read(), legacy._read_history(), legacy._read_reviews()
+            with self._tx():
+                self._insert_many("queue", ORDER_COLUMNS, queue)
+                self._insert_many("history", HISTORY_COLUMNS, history)
+                self._insert_many("reviews", REVIEW_COLUMNS, reviews)
+                for item in queue + history:
+                    payload = legacy._read_blob(item["result_blob"]) if item.get("result_blob") else None
+                    if payload is not None:
+                        self._put_blob(payload)
+                self._set_meta("json_imported", now_ekb().isoformat())
+        log.info(
+            "Imported JSON into %s: queue=%s history=%s reviews=%s",
+            self.db_path,
+            len(queue),
+            len(history),
+            len(reviews),
+        )
+        return True
+
+    def _insert_many(self, table: str, columns: Tuple[str, ...], items: Iterable[Dict]) -> None:
+        placeholders = ", ".join("?" for _ in columns)
+        self._conn.executemany(
+            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+            [_to_db(item, columns) for item in items],
+        )
+
+    def _queue_rows(
+        self, where: str = "1", params: Tuple = (), conn: Optional[sqlite3.Connection] = None
+    ) -> List[Dict]:
+        # внутри транзакции читаем через соединение писателя, чтобы видеть её же изменения
+        conn = conn or self._db()
+        rows = conn.execute(f"SELECT * FROM {RANKED_QUEUE} WHERE {where} ORDER BY position", params).fetchall()
+        return [_from_db(row) for row in rows]
+
+    def _queue_item(self, where: str, params: Tuple, conn: Optional[sqlite3.Connection] = None) -> Optional[Dict]:
+        rows = self._queue_rows(where, params, conn)
+        return rows[0] if rows else None
+
+    def _next_order_id(self) -> int:
+        # счётчик в meta не откатывается после очистки архива, номера не повторяются
+        value = self._meta("order_seq")
+        if value is None:
+            row = self._conn.execute(
+                "SELECT MAX(m) AS m FROM (SELECT MAX(order_id) AS m FROM queue UNION ALL SELECT MAX(order_id) FROM history)"
+            ).fetchone()
+            value = row["m"] or 0
+        order_id = int(value) + 1
+        self._set_meta("order_seq", str(order_id))
+        return order_id
+
+    @locked
+    def add_request(
+        self,
+        user_id: int,
+        service_id: str,
+        birth_date: str,
+        name: str,
+        problem: str,
+        user_username: Optional[str],
+        user_fullname: Optional[str],
+        is_urgent: bool,
+        price: Optional[int],
+        phone: Optional[str],
+        payment_status: str = "pending",
+    ) -> int:
+        with self._tx():
+            order_id = self._next_order_id()
+            new_item = {
+                "order_id": order_id,
+                "user_id": user_id,
+                "service_id": service_id,
+                "birth_date": birth_date,
+                "name": name,
+                "problem": problem,
+                "user_username": user_username,
+                "user_fullname": user_fullname,
+                "is_urgent": is_urgent,
+                "price": price,
+                "phone": phone,
+                "payment_status": payment_status,
+                "session_status": "pending",
+                "result_sent": False,
+                "result_payload": None,
+                "review_skipped_at": None,
+                "created_at": now_ekb().isoformat(),
+            }
+            self._insert_many("queue", ORDER_COLUMNS, [new_item])
+            self._index_search("live", order_id, new_item)
+        item = self._queue_item("order_id = ?", (order_id,))
+        return item["position"] if item else 0
+
+    def list_user_requests(self, user_id: int) -> List[str]:
+        rows = self._db().execute(f"SELECT * FROM queue WHERE user_id = ? ORDER BY {QUEUE_ORDER}", (user_id,))
+        return [format_user_request(_from_db(row)) for row in rows]
+
+    def list_user_orders(self, user_id: int) -> List[Dict]:
+        rows = self._db().execute("SELECT * FROM history WHERE user_id = ? ORDER BY archive_id DESC", (user_id,))
+        return self._queue_rows("user_id = ?", (user_id,)) + [_from_db(row) for row in rows]
+
+    def _index_search(self, kind: str, ref: int, item: Dict) -> None:
+        if self._fts:
+            self._conn.execute(
+                "INSERT INTO order_search (tokens, kind, ref) VALUES (?, ?, ?)",
+                (" ".join(sorted(item_tokens(item))), kind, ref),
+            )
+
+    def _unindex_search(self, kind: str, ref: int) -> None:
+        if self._fts:
+            self._conn.execute("DELETE FROM order_search WHERE kind = ? AND ref = ?", (kind, ref))
+
+    @locked
+    def _rebuild_search(self) -> None:
+        with self._tx():
+            self._conn.execute("DELETE FROM order_search")
+            for row in self._conn.execute("SELECT * FROM queue"):
+                self._index_search("live", row["order_id"], dict(row))
+            for row in self._conn.execute("SELECT * FROM history"):
+                self._index_search("arch", row["archive_id"], dict(row))
+            self._set_meta("search_built", now_ekb().isoformat())
+
+    def _index_review(self, review_id: int, text: Optional[str]) -> None:
+        if self._fts:
+            self._conn.execute(
+                "INSERT INTO review_search (terms, review_id) VALUES (?, ?)",
+                (" ".join(text_terms(text or "")), review_id),
+            )
+
+    @locked
+    def _rebuild_review_search(self) -> None:
+        with self._tx():
+            self._conn.execute("DELETE FROM review_search")
+            for row in self._conn.execute("SELECT review_id, text FROM reviews"):
+                self._index_review(row["review_id"], row["text"])
+            self._set_meta("review_search_built", now_ekb().isoformat())
+
+    def find_orders(self, query: str, limit: int = 20) -> Dict:
+        conn = self._db()
+        tokens = query_tokens(query)
+        if not tokens:
+            return {"items": [], "total": 0}
+        if not self._fts:
+            live = matches(query, self._queue_rows())
+            rows = conn.execute("SELECT * FROM history ORDER BY archive_id DESC")
+            archived = matches(query, [_from_db(row) for row in rows])
+            return {"items": (live + archived)[:limit], "total": len(live) + len(archived)}
+        hits = conn.execute(
+            "SELECT kind, ref FROM order_search WHERE order_search MATCH ?",
+            (" AND ".join(f'"{token}"*' for token in tokens),),
+        ).fetchall()
+        live_ids = [hit["ref"] for hit in hits if hit["kind"] == "live"]
+        archive_ids = sorted((hit["ref"] for hit in hits if hit["kind"] == "arch"), reverse=True)
+        items = []
+        if live_ids:
+            placeholders = ", ".join("?" for _ in live_ids)
+            items = self._queue_rows(f"order_id IN ({placeholders})", tuple(live_ids))[:limit]
+        items += [self.get_history_by_id(archive_id) for archive_id in archive_ids[: limit - len(items)]]
+        return {"items": items, "total": len(hits)}
+
+    def list_all(self) -> List[Dict]:
+        return self._queue_rows()
+
+    def list_by_payment_status(self, statuses: List[str]) -> List[Dict]:
+        if not statuses:
+            return []
+        placeholders = ", ".join("?" for _ in statuses)
+        return self._queue_rows(f"payment_status IN ({placeholders})", tuple(statuses))
+
+    def _update_by_position(self, position: int, column: str, value) -> bool:
+        item = self._queue_item("position = ?", (position,))
+        if not item:
+            return False
+        with self._tx():
+            self._conn.execute(f"UPDATE queue SET {column} = ? WHERE order_id = ?", (value, item["order_id"]))
+        return True
+
+    @locked
+    def update_payment_status(self, position: int, status: str) -> bool:
+        return self._update_by_position(position, "payment_status", status)
+
+    @locked
+    def update_session_status(self, position: int, status: str) -> bool:
+        return self._update_by_position(position, "session_status", status)
+
+    def get_by_position(self, position: int) -> Optional[Dict]:
+        return self._queue_item("position = ?", (position,))
+
+    def get_by_order_id(self, order_id: int) -> Optional[Dict]:
+        return self._queue_item("order_id = ?", (order_id,))
+
+    @locked
+    def delete_and_archive(self, position: int) -> bool:
+        target = self._queue_item("position = ?", (position,))
+        if not target:
+            return False
+        return self.archive_orders([target["order_id"]]) > 0
+
+    @locked
+    def archive_orders(self, order_ids: Iterable[int]) -> int:
+        archived_at = now_ekb().isoformat()
+        archived = 0
+        with self._tx():
+            row = self._conn.execute("SELECT COALESCE(MAX(archive_id), 0) AS last_id FROM history").fetchone()
+            archive_id = row["last_id"]
+            for order_id in order_ids:
+                # позиция считается заново после каждого удаления — как при архивации по одному
+                target = self._queue_item("order_id = ?", (order_id,), conn=self._conn)
+                if not target:
+                    continue
+                archive_id += 1
+                target["archived_at"] = archived_at
+                target["archive_id"] = archive_id
+                self._insert_many("history", HISTORY_COLUMNS, [target])
+                self._conn.execute("DELETE FROM queue WHERE order_id = ?", (order_id,))
+                self._add_stats([target])
+                self._unindex_search("live", order_id)
+                self._index_search("arch", archive_id, target)
+                archived += 1
+        return archived
+
+    @locked
+    def archive_done(self) -> int:
+        rows = self._conn.execute("SELECT order_id FROM queue WHERE session_status = 'done'").fetchall()
+        return self.archive_orders([row["order_id"] for row in rows])
+
+    @locked
+    def _rebuild_queue_counts(self) -> None:
+        # для баз, созданных до появления триггеров
+        with self._tx():
+            self._conn.execute("DELETE FROM queue_counts")
+            self._conn.execute(
+                "INSERT INTO queue_counts SELECT COALESCE(service_id, ''), payment_status, session_status, COUNT(*) "
+                "FROM queue GROUP BY 1, 2, 3"
+            )
+            self._set_meta("queue_counts_built", now_ekb().isoformat())
+
+    def queue_page(
+        self,
+        service_id: Optional[str] = None,
+        payment_status: Optional[str] = None,
+        session_done: Optional[bool] = None,
+        after: Optional[int] = None,
+        before: Optional[int] = None,
+        limit: int = 5,
+    ) -> Dict:
+        conn = self._db()
+        filters, params = [], []
+        if service_id is not None:
+            filters.append("COALESCE(service_id, '') = ?")
+            params.append(service_id)
+        if payment_status is not None:
+            filters.append("payment_status = ?")
+            params.append(payment_status)
+        if session_done is not None:
+            filters.append("session_status = 'done'" if session_done else "session_status != 'done'")
+        where = " AND ".join(filters) or "1"
+        total = conn.execute(f"SELECT COALESCE(SUM(n), 0) AS n FROM queue_counts WHERE {where}", params).fetchone()
+
+        def rows(condition: str, anchor: Tuple, order: str, count: int) -> List[Dict]:
+            return [
+                _from_db(row)
+                for row in conn.execute(
+                    f"SELECT * FROM {RANKED_QUEUE} WHERE {where} AND {condition} ORDER BY position {order} LIMIT ?",
+                    tuple(params) + anchor + (count,),
+                )
+            ]
+
+        cursor = before if before is not None else after
+        anchor_row = None
+        if cursor is not None:
+            # курсор мог уйти в архив — ключ сортировки у записи тот же
+            anchor_row = conn.execute(
+                "SELECT is_urgent, created_at, order_id FROM queue WHERE order_id = ? "
+                "UNION ALL SELECT is_urgent, created_at, order_id FROM history WHERE order_id = ? LIMIT 1",
+                (cursor, cursor),
+            ).fetchone()
+        page = {"items": []}
+        if anchor_row is not None:
+            anchor = (-anchor_row["is_urgent"], anchor_row["created_at"], anchor_row["order_id"])
+            later, earlier = "(-is_urgent, created_at, order_id) > (?, ?, ?)", "(-is_urgent, created_at, order_id) < (?, ?, ?)"
+            if before is not None:
+                page = keyset_page(
+                    iter(rows(earlier, anchor, "DESC", limit + 1)),
+                    iter(rows(f"NOT {earlier}", anchor, "", 1)),
+                    limit,
+                    "order_id",
+                    backward=True,
+                )
+            else:
+                page = keyset_page(
+                    iter(rows(later, anchor, "", limit + 1)),
+                    iter(rows(f"NOT {later}", anchor, "DESC", 1)),
+                    limit,
+                    "order_id",
+                )
+        if not page["items"]:
+            page = keyset_page(iter(rows("1", (), "", limit + 1)), iter(()), limit, "order_id")
+        page["total"] = total["n"]
+        return page
+
+    def history_page(
+        self,
+        service_id: Optional[str] = None,
+        after: Optional[int] = None,
+        before: Optional[int] = None,
+        limit: int = 5,
+    ) -> Dict:
+        conn = self._db()
+        where, params = ("service_id = ?", (service_id,)) if service_id is not None else ("1", ())
+
+        def rows(condition: str, anchor: Tuple, order: str, count: int) -> List[Dict]:
+            return [
+                _from_db(row)
+                for row in conn.execute(
+                    f"SELECT * FROM history WHERE {where} AND {condition} ORDER BY archive_id {order} LIMIT ?",
+                    params + anchor + (count,),
+                )
+            ]
+
+        if before is not None:
+            page = keyset_page(
+                iter(rows("archive_id > ?", (before,), "", limit + 1)),
+                iter(rows("archive_id <= ?", (before,), "DESC", 1)),
+                limit,
+                "archive_id",
+                backward=True,
+            )
+        elif after is not None:
+            page = keyset_page(
+                iter(rows("archive_id < ?", (after,), "DESC", limit + 1)),
+                iter(rows("archive_id >= ?", (after,), "", 1)),
+                limit,
+                "archive_id",
+            )
+        else:
+            page = {"items": []}
+        if not page["items"]:
+            page = keyset_page(iter(rows("1", (), "DESC", limit + 1)), iter(()), limit, "archive_id")
+        page["total"] = self.history_stats(0, service_id)[0]
+        return page
+
+    def timeline_page(self, service_id: Optional[str] = None, offset: int = 0, limit: int = 5) -> Dict:
+        conn = self._db()
+        where, params = ("service_id = ?", (service_id,)) if service_id is not None else ("1", ())
+        keys = conn.execute(
+            f"SELECT 'live' AS kind, order_id AS id, created_at FROM queue WHERE {where} "
+            f"UNION ALL SELECT 'arch', archive_id, created_at FROM history WHERE {where} "
+            "ORDER BY created_at DESC, kind DESC, id DESC LIMIT ? OFFSET ?",
+            params + params + (limit, offset),
+        ).fetchall()
+        items = []
+        for key in keys:
+            if key["kind"] == "live":
+                item = self._queue_item("order_id = ?", (key["id"],), conn=conn)
+            else:
+                item = self.get_history_by_id(key["id"])
+            items.append({"kind": key["kind"], "item": item, "review": self.get_review_for_order(item["order_id"])})
+        live = conn.execute(f"SELECT COALESCE(SUM(n), 0) AS n FROM queue_counts WHERE {where}", params).fetchone()
+        return {"items": items, "total": live["n"] + self.history_stats(0, service_id)[0]}
+
+    def list_history(self, limit: int = 20) -> List[Dict]:
+        rows = self._db().execute("SELECT * FROM history ORDER BY archive_id DESC LIMIT ?", (limit,)).fetchall()
+        return [_from_db(row) for row in rows]
+
+    def get_history_by_id(self, archive_id: int) -> Optional[Dict]:
+        row = self._db().execute("SELECT * FROM history WHERE archive_id = ?", (archive_id,)).fetchone()
+        return _from_db(row) if row else None
+
+    def get_history_by_order_id(self, order_id: int) -> Optional[Dict]:
+        row = self._db().execute(
+            "SELECT * FROM history WHERE order_id = ? ORDER BY archive_id LIMIT 1", (order_id,)
+        ).fetchone()
+        return _from_db(row) if row else None
+
+    def _update_order(self, order_id: int, fields: Dict) -> bool:
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        values = _to_db(fields, tuple(fields))
+        with self._tx():
+            for table in ("queue", "history"):
+                cursor = self._conn.execute(
+                    f"UPDATE {table} SET {assignments} WHERE order_id = ?", values + (order_id,)
+                )
+                if cursor.rowcount:
+                    return True
+        return False
+
+    def _put_blob(self, payload: Dict) -> str:
+        text = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        self._conn.execute("INSERT OR IGNORE INTO blobs (hash, body) VALUES (?, ?)", (digest, text))
+        return digest
+
+    @locked
+    def _move_payloads_to_blobs(self) -> None:
+        with self._tx():
+            for table in ("queue", "history"):
+                rows = self._conn.execute(
+                    f"SELECT order_id, result_payload FROM {table} WHERE result_payload IS NOT NULL"
+                ).fetchall()
+                for row in rows:
+                    digest = self._put_blob(json.loads(row["result_payload"]))
+                    self._conn.execute(
+                        f"UPDATE {table} SET result_blob = ?, result_payload = NULL WHERE order_id = ?",
+                        (digest, row["order_id"]),
+                    )
+            self._set_meta("result_blobs_moved", now_ekb().isoformat())
+
+    @locked
+    def set_result_sent(self, order_id: int, payload: Dict) -> bool:
+        exists = self._conn.execute(
+            "SELECT 1 FROM queue WHERE order_id = ? UNION ALL SELECT 1 FROM history WHERE order_id = ?",
+            (order_id, order_id),
+        ).fetchone()
+        if not exists:
+            return False
+        with self._tx():
+            fields = {"result_sent": True, "result_blob": self._put_blob(payload), "result_payload": None}
+            return self._update_order(order_id, fields)
+
+    def get_result_payload(self, order_id: int) -> Optional[Dict]:
+        row = self._db().execute(
+            "SELECT result_blob, result_payload FROM queue WHERE order_id = ? "
+            "UNION ALL SELECT result_blob, result_payload FROM history WHERE order_id = ? LIMIT 1",
+            (order_id, order_id),
+        ).fetchone()
+        if not row:
+            return None
+        if row["result_blob"]:
+            blob = self._db().execute("SELECT body FROM blobs WHERE hash = ?", (row["result_blob"],)).fetchone()
+            return json.loads(blob["body"]) if blob else None
+        return json.loads(row["result_payload"]) if row["result_payload"] else None
+
+    @locked
+    def set_review_skipped(self, order_id: int) -> bool:
+        return self._update_order(order_id, {"review_skipped_at": now_ekb().isoformat()})
+
+    def _add_stats(self, items: Iterable[Dict]) -> None:
+        stats = HistoryStats()
+        for item in items:
+            stats.add(item)
+        self._conn.executemany(
+            "INSERT INTO history_stats (scope, key, orders, priced_sum, unpriced) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (scope, key) DO UPDATE SET orders = orders + excluded.orders, "
+            "priced_sum = priced_sum + excluded.priced_sum, unpriced = unpriced + excluded.unpriced",
+            list(stats.rows()),
+        )
+
+    def _write_stats(self, stats: HistoryStats) -> None:
+        self._conn.execute("DELETE FROM history_stats")
+        self._conn.executemany(
+            "INSERT INTO history_stats (scope, key, orders, priced_sum, unpriced) VALUES (?, ?, ?, ?, ?)",
+            list(stats.rows()),
+        )
+
+    def _stats_rows(
+        self, scope: str, default_price: int, where: str = "", params: Tuple = ()
+    ) -> List[Tuple[str, int, int]]:
+        rows = self._db().execute(
+            f"SELECT key, orders, priced_sum + unpriced * ? AS total_sum FROM history_stats WHERE scope = ? {where}",
+            (default_price, scope) + params,
+        ).fetchall()
+        return [(row["key"], row["orders"], row["total_sum"]) for row in rows]
+
+    def history_stats(self, default_price: int = 2500, service_id: str | None = None) -> tuple[int, int]:
+        if service_id:
+            rows = self._stats_rows("service", default_price, "AND key = ?", (service_id,))
+        else:
+            rows = self._stats_rows("total", default_price)
+        return (rows[0][1], rows[0][2]) if rows else (0, 0)
+
+    def history_breakdown(
+        self, default_price: int = 2500, days: int = 7, months: int = 6
+    ) -> Dict[str, List[Tuple[str, int, int]]]:
+        return {
+            "service": self._stats_rows("service", default_price, "ORDER BY key"),
+            "day": self._stats_rows("day", default_price, "ORDER BY key DESC LIMIT ?", (days,)),
+            "month": self._stats_rows("month", default_price, "ORDER BY key DESC LIMIT ?", (months,)),
+        }
+
+    @locked
+    def rebuild_history_stats(self) -> int:
+        stats = HistoryStats()
+        for row in self._conn.execute("SELECT service_id, price, created_at, archived_at FROM history"):
+            stats.add(dict(row))
+        with self._tx():
+            self._write_stats(stats)
+            self._set_meta("history_stats_built", now_ekb().isoformat())
+        return stats.get("total", "", 0)[0]
+
+    @locked
+    def add_review(
+        self,
+        user_id: int,
+        service_id: str,
+        text: str,
+        user_username: Optional[str],
+        user_fullname: Optional[str],
+        name: Optional[str],
+        birth_date: Optional[str],
+        order_created_at: Optional[str],
+        order_id: Optional[int],
+    ) -> int:
+        new_item = {
+            "user_id": user_id,
+            "service_id": service_id,
+            "text": text,
+            "user_username": user_username,
+            "user_fullname": user_fullname,
+            "name": name,
+            "birth_date": birth_date,
+            "order_created_at": order_created_at,
+            "order_id": order_id,
+            "created_at": now_ekb().isoformat(),
+        }
+        columns = REVIEW_COLUMNS[1:]
+        with self._tx():
+            cursor = self._conn.execute(
+                f"INSERT INTO reviews ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                _to_db(new_item, columns),
+            )
+            self._index_review(cursor.lastrowid, text)
+        return cursor.lastrowid
+
+    def list_reviews(self, service_id: str | None = None) -> List[Dict]:
+        rows = self._db().execute(
+            "SELECT * FROM reviews WHERE (? IS NULL OR service_id = ?) ORDER BY review_id DESC",
+            (service_id or None, service_id or None),
+        ).fetchall()
+        return [_from_db(row) for row in rows]
+
+    def search_reviews(self, query: str, service_id: str | None = None, offset: int = 0, limit: int = 5) -> Dict:
+        terms = sorted(set(text_terms(query)))
+        if not terms:
+            return {"items": [], "total": 0}
+        if not self._fts:
+            index = TextIndex()
+            for item in self.list_reviews(service_id):
+                index.add(item["review_id"], item.get("text") or "")
+            ranked = index.search(query)
+            items = [dict(self.get_review_by_id(key), score=round(score, 3)) for score, key in ranked[offset : offset + limit]]
+            return {"items": items, "total": len(ranked)}
+        conn = self._db()
+        match = " OR ".join(f'"{term}"' for term in terms)
+        where = "review_search MATCH ? AND (? IS NULL OR r.service_id = ?)"
+        params = (match, service_id or None, service_id or None)
+        rows = conn.execute(
+            "SELECT r.*, -bm25(review_search) AS score FROM review_search "
+            f"JOIN reviews r ON r.review_id = review_search.review_id WHERE {where} "
+            "ORDER BY score DESC, r.review_id DESC LIMIT ? OFFSET ?",
+            params + (limit, offset),
+        ).fetchall()
+        total = conn.execute(
+            f"SELECT COUNT(*) AS n FROM review_search JOIN reviews r ON r.review_id = review_search.review_id WHERE {where}",
+            params,
+        ).fetchone()
+        items = [dict(_from_db(row), score=round(row["score"], 3)) for row in rows]
+        return {"items": items, "total": total["n"]}
+
+    def get_review_by_id(self, review_id: int) -> Optional[Dict]:
+        row = self._db().execute("SELECT * FROM reviews WHERE review_id = ?", (review_id,)).fetchone()
+        return _from_db(row) if row else None
+
+    def get_review_for_order(self, order_id: Optional[int]) -> Optional[Dict]:
+        if not order_id:
+            return None
+        row = self._db().execute(
+            "SELECT * FROM reviews WHERE order_id = ? ORDER BY review_id LIMIT 1", (order_id,)
+        ).fetchone()
+        return _from_db(row) if row else None
+
+    @locked
+    def clear_history(self) -> None:
+        with self._tx():
+            self._conn.execute("DELETE FROM history")
+            self._conn.execute("DELETE FROM history_stats")
+            if self._fts:
+                self._conn.execute("DELETE FROM order_search WHERE kind = 'arch'")
+
@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+# модуль хранилища при импорте создаёт общее хранилище — уводим его во временный каталог
+_tmp = tempfile.mkdtemp(prefix="gadalka-test-")
+os.environ.setdefault("BOT_TOKEN", "test")
+os.environ.setdefault("STORAGE_PATH", os.path.join(_tmp, "queue.json"))
+os.environ.setdefault("HISTORY_PATH", os.path.join(_tmp, "history.json"))
+os.environ.setdefault("REVIEWS_PATH", os.path.join(_tmp, "reviews.json"))
+os.environ.setdefault("SQLITE_PATH", os.path.join(_tmp, "db.sqlite3"))
+
+from app.storage import QueueStorage  # noqa: E402
+
+
+class HistoryStatsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = Path(tempfile.mkdtemp(prefix="gadalka-test-"))
+        self.storage = self._open()
+
+    def _open(self) -> QueueStorage:
+        return QueueStorage(
+            self.dir / "queue.json",
+            self.dir / "history.json",
+            self.dir / "reviews.json",
+            commit_window=0,
+        )
+
+    def _archive(self, user_id: int) -> None:
+        self.storage.add_request(user_id, "express", "01.01.1990", f"name{user_id}", "problem", None, None, False, None, None, "paid")
+        order_id = self.storage.list_all()[-1]["order_id"]
+        self.assertEqual(self.storage.archive_orders([order_id]), 1)
+
+    def test_archive_after_stats_file_lost(self) -> None:
+        self._archive(1)
+        expected = self.storage.history_stats()
+        self.assertEqual(expected[0], 1)
+        self.storage.stats_path.unlink()
+        self.storage = self._open()
+        self._archive(2)
+        self.assertEqual(self.storage.history_stats(), (2, expected[1] * 2))
+        self.assertEqual(self._open().history_stats(), (2, expected[1] * 2))
+
+
+if __name__ == "__main__":
+    unittest.main()